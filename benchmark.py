@@ -0,0 +1,274 @@
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+import numpy as np
+
+import main
+
+CONFIGS = {
+    "bnb": {"algorithm": "bnb"},
+    "bnb-serial": {"algorithm": "bnb", "workers": 1},
+    "bnb-no-warm": {"algorithm": "bnb", "workers": 1, "warm_start": "none"},
+    "bnb-reduction": {"algorithm": "bnb", "workers": 1, "bound": "reduction"},
+    "bnb-one-tree": {"algorithm": "bnb", "workers": 1, "bound": "one_tree"},
+    "held_karp": {"algorithm": "held_karp"},
+    "heuristic": {"algorithm": "heuristic", "workers": 1},
+}
+GENERATORS = ("euclidean", "clustered", "asymmetric")
+DEFAULT_SIZES = "5,8,10,12"
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_MIN_TIME = 0.05
+
+def euclidean_instance(n: int, seed: int):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 1000, (n, 2))
+    return np.round(np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))).tolist()
+
+def clustered_instance(n: int, seed: int):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, 1000, (max(1, n // 5), 2))
+    points = centers[rng.integers(len(centers), size=n)] + rng.normal(0, 30, (n, 2))
+    return np.round(np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))).tolist()
+
+def asymmetric_instance(n: int, seed: int):
+    rng = np.random.default_rng(seed)
+    matrix = rng.integers(1, 1000, (n, n)).astype(float)
+    np.fill_diagonal(matrix, 0)
+    return matrix.tolist()
+
+def tsplib_distance(weight_type: str, a, b) -> float:
+    if weight_type == "EUC_2D":
+        return float(round(math.hypot(a[0] - b[0], a[1] - b[1])))
+    if weight_type == "CEIL_2D":
+        return float(math.ceil(math.hypot(a[0] - b[0], a[1] - b[1])))
+    if weight_type == "ATT":
+        r = math.sqrt(((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) / 10.0)
+        return float(math.ceil(r) if round(r) < r else round(r))
+    if weight_type == "GEO":
+        def radians(x):
+            degrees = int(x)
+            return math.pi * (degrees + 5.0 * (x - degrees) / 3.0) / 180.0
+        lat_a, lon_a, lat_b, lon_b = radians(a[0]), radians(a[1]), radians(b[0]), radians(b[1])
+        q1, q2, q3 = math.cos(lon_a - lon_b), math.cos(lat_a - lat_b), math.cos(lat_a + lat_b)
+        return float(int(6378.388 * math.acos(0.5 * ((1.0 + q1) * q2 - (1.0 - q1) * q3)) + 1.0))
+    raise ValueError(f"Неподдерживаемый EDGE_WEIGHT_TYPE: {weight_type}")
+
+def load_tsplib(path: str):
+    spec = {}
+    coords = []
+    weights = []
+    section = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line == "EOF":
+                continue
+            if line.endswith("_SECTION"):
+                section = line
+                continue
+            if ":" in line and not line[0].isdigit() and line[0] not in "-.":
+                key, value = line.split(":", 1)
+                spec[key.strip()] = value.strip()
+                section = None
+                continue
+            if section == "NODE_COORD_SECTION":
+                _, x, y = line.split()[:3]
+                coords.append((float(x), float(y)))
+            elif section == "EDGE_WEIGHT_SECTION":
+                weights.extend(float(v) for v in line.split())
+
+    n = int(spec["DIMENSION"])
+    weight_type = spec.get("EDGE_WEIGHT_TYPE", "EUC_2D")
+    if weight_type != "EXPLICIT":
+        return [[0.0 if i == j else tsplib_distance(weight_type, coords[i], coords[j]) for j in range(n)] for i in range(n)]
+
+    weight_format = spec.get("EDGE_WEIGHT_FORMAT", "FULL_MATRIX")
+    if weight_format == "FULL_MATRIX":
+        return [weights[i * n:(i + 1) * n] for i in range(n)]
+
+    # Triangular formats: walk the cells of the stored triangle in file order and mirror them.
+    cells = {
+        "UPPER_ROW": [(i, j) for i in range(n) for j in range(i + 1, n)],
+        "LOWER_ROW": [(i, j) for i in range(n) for j in range(i)],
+        "UPPER_DIAG_ROW": [(i, j) for i in range(n) for j in range(i, n)],
+        "LOWER_DIAG_ROW": [(i, j) for i in range(n) for j in range(i + 1)],
+        "UPPER_COL": [(i, j) for j in range(n) for i in range(j)],
+        "LOWER_COL": [(i, j) for j in range(n) for i in range(j + 1, n)],
+    }.get(weight_format)
+    if cells is None:
+        raise ValueError(f"Неподдерживаемый EDGE_WEIGHT_FORMAT: {weight_format}")
+    matrix = [[0.0] * n for _ in range(n)]
+    for (i, j), value in zip(cells, weights):
+        matrix[i][j] = matrix[j][i] = value
+    return matrix
+
+def build_instances(kinds: list[str], sizes: list[int], seeds: list[int], tsplib_paths: list[str]):
+    generators = {"euclidean": euclidean_instance, "clustered": clustered_instance, "asymmetric": asymmetric_instance}
+    instances = []
+    for kind in kinds:
+        for n in sizes:
+            for seed in seeds:
+                instances.append({"instance": f"{kind}-{n}-s{seed}", "kind": kind, "n": n, "seed": seed,
+                                  "matrix": generators[kind](n, seed)})
+    for path in tsplib_paths:
+        matrix = load_tsplib(path)
+        instances.append({"instance": os.path.splitext(os.path.basename(path))[0], "kind": "tsplib", "n": len(matrix),
+                          "seed": None, "matrix": matrix})
+    return instances
+
+def run_config(matrix, config: dict, time_limit_ms: Optional[int]):
+    options = dict(config)
+    solver = main.SOLVERS[options.pop("algorithm")]
+    return solver(matrix, time_limit_ms=time_limit_ms, **options)
+
+def measure(instance: dict, config_name: str, repeat: int, time_limit_ms: Optional[int], track_memory: bool) -> dict:
+    config = CONFIGS[config_name]
+    record = {key: instance[key] for key in ("instance", "kind", "n", "seed")}
+    record["config"] = config_name
+
+    times = []
+    result = None
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = run_config(instance["matrix"], config, time_limit_ms)
+            times.append(time.perf_counter() - started)
+
+        # Memory is measured in a separate run: tracemalloc slows allocation-heavy code down too much to share a run
+        # with the timings. Only the allocations of this process are seen, parallel workers are not.
+        peak_memory = None
+        if track_memory:
+            tracemalloc.start()
+            try:
+                run_config(instance["matrix"], config, time_limit_ms)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    except ValueError as e:
+        record.update({"status": "error", "error": str(e)})
+        return record
+
+    record.update({
+        "status": result["status"],
+        "wall_time": statistics.median(times),
+        "times": times,
+        "nodes_explored": result.get("nodes_explored"),
+        "nodes_popped": result.get("nodes_popped"),
+        "nodes_dominated": result.get("nodes_dominated"),
+        "peak_node_memory": result.get("peak_node_memory"),
+        "peak_memory": peak_memory,
+        "cost": result["distance"] if isinstance(result["distance"], float) else None,
+    })
+    return record
+
+def run_benchmark(args) -> dict:
+    sizes = [int(v) for v in args.sizes.split(",")]
+    seeds = [int(v) for v in args.seeds.split(",")]
+    kinds = [v for v in args.generators.split(",") if v]
+    configs = args.configs.split(",")
+    for name in configs:
+        if name not in CONFIGS:
+            raise SystemExit(f"Неизвестная конфигурация: {name} (доступны: {', '.join(CONFIGS)})")
+    for kind in kinds:
+        if kind not in GENERATORS:
+            raise SystemExit(f"Неизвестный генератор: {kind} (доступны: {', '.join(GENERATORS)})")
+
+    runs = []
+    for instance in build_instances(kinds, sizes, seeds, args.tsplib):
+        for config_name in configs:
+            if config_name == "held_karp" and instance["n"] > main.HELD_KARP_MAX_N:
+                continue
+            record = measure(instance, config_name, args.repeat, args.time_limit_ms, not args.no_memory)
+            runs.append(record)
+            if record["status"] == "error":
+                print(f"{record['instance']:<24} {config_name:<12} ошибка: {record['error']}")
+            else:
+                print(f"{record['instance']:<24} {config_name:<12} {record['wall_time']:>9.4f} с  "
+                      f"узлов: {record['nodes_explored'] or 0:>8}  стоимость: {record['cost']}  {record['status']}")
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "time_limit_ms": args.time_limit_ms,
+        "runs": runs,
+    }
+
+def compare_reports(baseline: dict, current: dict, threshold: float, min_time: float) -> list[str]:
+    problems = []
+    previous = {(run["instance"], run["config"]): run for run in baseline["runs"]}
+    for run in current["runs"]:
+        old = previous.get((run["instance"], run["config"]))
+        if old is None or "error" in run or "error" in old:
+            continue
+        name = f"{run['instance']} [{run['config']}]"
+        if run["status"] == old["status"] == "optimal" and run["cost"] is not None and old["cost"] is not None \
+                and abs(run["cost"] - old["cost"]) > 1e-6 * max(1.0, abs(old["cost"])):
+            problems.append(f"{name}: стоимость изменилась {old['cost']} -> {run['cost']}")
+        # Very short runs are mostly noise, so they are only compared once either side takes at least min_time.
+        if max(run["wall_time"], old["wall_time"]) < min_time:
+            continue
+        if run["wall_time"] > old["wall_time"] * (1 + threshold):
+            problems.append(f"{name}: время {old['wall_time']:.4f} с -> {run['wall_time']:.4f} с "
+                            f"(+{(run['wall_time'] / old['wall_time'] - 1) * 100:.0f}%)")
+    return problems
+
+def load_report(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Бенчмарк решателей TSP")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="прогнать бенчмарк и сохранить JSON-отчёт")
+    run_parser.add_argument("--sizes", default=DEFAULT_SIZES, help="размеры матриц через запятую")
+    run_parser.add_argument("--seeds", default="0", help="сиды генераторов через запятую")
+    run_parser.add_argument("--generators", default=",".join(GENERATORS), help="генераторы экземпляров через запятую")
+    run_parser.add_argument("--tsplib", nargs="*", default=[], help="файлы в формате TSPLIB")
+    run_parser.add_argument("--configs", default="bnb-serial,held_karp", help="конфигурации решателя через запятую")
+    run_parser.add_argument("--repeat", type=int, default=3, help="число замеров времени на экземпляр")
+    run_parser.add_argument("--time-limit-ms", type=int, default=None, help="лимит времени одного решения")
+    run_parser.add_argument("--no-memory", action="store_true", help="не замерять пиковую память")
+    run_parser.add_argument("--output", default="benchmark.json", help="файл отчёта")
+    run_parser.add_argument("--baseline", default=None, help="сравнить с сохранённым отчётом после прогона")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="допустимое замедление (0.2 = 20%%)")
+    run_parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="не сравнивать прогоны короче (с)")
+
+    compare_parser = commands.add_parser("compare", help="сравнить отчёт с базовым")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="допустимое замедление (0.2 = 20%%)")
+    compare_parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="не сравнивать прогоны короче (с)")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run_benchmark(args)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт сохранён в {args.output}")
+        if not args.baseline:
+            return
+        baseline, current = load_report(args.baseline), report
+    else:
+        baseline, current = load_report(args.baseline), load_report(args.current)
+
+    problems = compare_reports(baseline, current, args.threshold, args.min_time)
+    for problem in problems:
+        print(f"РЕГРЕССИЯ: {problem}")
+    if problems:
+        sys.exit(1)
+    print("Регрессий не найдено")
+
+if __name__ == "__main__":
+    main_cli()
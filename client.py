@@ -1,24 +1,46 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 from pydantic import BaseModel
 from typing import Union, Optional
 import re
+import os
+import sys
+import csv
 import time
+import random
 import hashlib
 import secrets
 import string
+import argparse
+import getpass
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+SERVER_URL = "http://localhost:8000"
+MATRIX_SUFFIXES = (".csv", ".json", ".ndjson", ".jsonl", ".npy")
+RETRY_STATUSES = (429, 503)
+RETRY_ATTEMPTS = 8
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 60
 
 current_session_token: Optional[str] = None
 current_technical_token: Optional[str] = None
 current_user_login: Optional[str] = None
 
+# one keep-alive connection pool for every request the client makes
+http_session = requests.Session()
+# Retry-After of the last response, per thread
+last_retry_after = threading.local()
+
 class User(BaseModel):
     login: str
     password: str
 
 def send_post(url, data):
     try:
-        response = requests.post(url, json=data)
+        response = http_session.post(url, json=data)
         return response.text, response.status_code
     except requests.exceptions.ConnectionError:
         print("Ошибка соединения")
@@ -45,21 +67,34 @@ def send_signed_request_v5(method: str, url: str, data: Optional[dict] = None):
     
     try:
         if method == 'GET':
-            response = requests.get(url, headers=headers)
+            response = http_session.get(url, headers=headers)
         elif method == 'POST':
-            response = requests.post(url, json=data, headers=headers)
+            response = http_session.post(url, json=data, headers=headers)
         elif method == 'PATCH':
-            response = requests.patch(url, json=data, headers=headers)
+            response = http_session.patch(url, json=data, headers=headers)
         elif method == 'DELETE':
-            response = requests.delete(url, headers=headers)
+            response = http_session.delete(url, headers=headers)
         else:
             raise ValueError(f"Unsupported method: {method}")
             
+        last_retry_after.value = response.headers.get("Retry-After")
         return response.text, response.status_code
     except requests.exceptions.ConnectionError:
-        print("Ошибка соединения")
+        print("Ошибка соединения", file=sys.stderr)
+        last_retry_after.value = None
         return None, 503
 
+def send_with_retry(method: str, url: str, data: Optional[dict] = None, attempts: int = RETRY_ATTEMPTS):
+    # 429/503 are retried after the server's Retry-After, or with exponential backoff and jitter; every attempt is signed anew
+    for attempt in range(attempts):
+        result, code = send_signed_request_v5(method, url, data)
+        if code not in RETRY_STATUSES or attempt == attempts - 1:
+            return result, code
+        retry_after = getattr(last_retry_after, "value", None)
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else RETRY_BASE_DELAY * 2 ** attempt
+        time.sleep(min(delay, RETRY_MAX_DELAY) * random.uniform(1, 1.25))
+    return result, code
+
 def validate_password(password):
     if len(password) < 10: return "Пароль должен содержать не менее 10 символов"
     if not re.search(r'[A-Z]', password): return "Пароль должен содержать хотя бы одну заглавную букву"
@@ -290,5 +325,163 @@ def main_menu():
             print("\nПрограмма завершена")
             break
 
-if __name__ == "__main__":
+def read_csv_matrices(path: str):
+    # a blank line separates matrices within one file
+    matrix = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if row and any(cell.strip() for cell in row):
+                matrix.append([float(cell) for cell in row])
+            elif matrix:
+                yield matrix
+                matrix = []
+    if matrix:
+        yield matrix
+
+def matrix_from_json(data):
+    matrix = data["matrix"] if isinstance(data, dict) else data
+    return [[float(value) for value in row] for row in matrix]
+
+def read_json_matrices(path: str):
+    if path.endswith((".ndjson", ".jsonl")):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield matrix_from_json(json.loads(line))
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    # a single matrix, {"matrix": ...}, or a list of either
+    if isinstance(data, dict) or (data and isinstance(data[0], list) and data[0] and not isinstance(data[0][0], list)):
+        yield matrix_from_json(data)
+    else:
+        for item in data:
+            yield matrix_from_json(item)
+
+def read_npy_matrices(path: str):
+    # a 2-D array is one matrix, a 3-D array a stack of them; memory-mapped, so only one matrix is read at a time
+    array = np.load(path, mmap_mode='r')
+    for matrix in ([array] if array.ndim == 2 else array):
+        yield np.asarray(matrix, dtype=np.float64).tolist()
+
+def iter_matrices(input_path: str):
+    # (id, matrix) for every matrix in a file or in the matrix files of a directory, read lazily
+    if os.path.isdir(input_path):
+        paths = sorted(os.path.join(input_path, name) for name in os.listdir(input_path) if name.lower().endswith(MATRIX_SUFFIXES))
+    else:
+        paths = [input_path]
+    for path in paths:
+        lower = path.lower()
+        if lower.endswith(".csv"):
+            matrices = read_csv_matrices(path)
+        elif lower.endswith(".npy"):
+            matrices = read_npy_matrices(path)
+        else:
+            matrices = read_json_matrices(path)
+        for index, matrix in enumerate(matrices):
+            yield f"{path}#{index}", matrix
+
+def bulk_login(server: str, login: str, password: str) -> bool:
+    global current_session_token, current_technical_token, current_user_login
+    result, code = send_post(f"{server}/users/auth", {"login": login, "password": password})
+    if code != 200 or not result:
+        print(f"Ошибка авторизации: {code}", file=sys.stderr)
+        return False
+    user_data = json.loads(result)
+    current_session_token = user_data['session_token']
+    current_technical_token = user_data['token']
+    current_user_login = user_data['login']
+    return True
+
+def solve_one(server: str, item_id: str, matrix: list, options: dict) -> list[dict]:
+    result, code = send_with_retry("POST", f"{server}/solve", {"matrix": matrix, **options})
+    if code == 200:
+        return [{"input": item_id, "result": json.loads(result)}]
+    try:
+        detail = json.loads(result).get("detail") if result else None
+    except ValueError:
+        detail = result
+    return [{"input": item_id, "status": code, "error": detail}]
+
+def solve_batch(server: str, items: list[tuple[str, list]], options: dict) -> list[dict]:
+    result, code = send_with_retry("POST", f"{server}/solve/batch", {"matrices": [matrix for _, matrix in items], **options})
+    if code != 200:
+        return [{"input": item_id, "status": code, "error": result} for item_id, _ in items]
+    lines = []
+    for line in result.splitlines():
+        if line.strip():
+            item = json.loads(line)
+            lines.append({"input": items[item.pop("index")][0], **item})
+    return lines
+
+def chunked(items, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_solve(args) -> int:
+    password = args.password or os.environ.get("TSP_PASSWORD") or getpass.getpass("Пароль: ")
+    # one pooled connection per worker thread
+    http_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=args.concurrency))
+    http_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=args.concurrency))
+    if not bulk_login(args.server, args.login, password):
+        return 1
+
+    options = json.loads(args.options) if args.options else {}
+    if args.batch_size > 1:
+        tasks = ((solve_batch, args.server, chunk, options) for chunk in chunked(iter_matrices(args.input), args.batch_size))
+    else:
+        tasks = ((solve_one, args.server, item_id, matrix, options) for item_id, matrix in iter_matrices(args.input))
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output != "-" else sys.stdout
+    counts = {"solved": 0, "failed": 0}
+
+    def write_results(futures):
+        for future in futures:
+            for line in future.result():
+                counts["solved" if "result" in line else "failed"] += 1
+                output.write(json.dumps(line, ensure_ascii=False) + "\n")
+        output.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            # at most two requests per worker are read and queued ahead, so input of any size is streamed
+            pending = set()
+            for task in tasks:
+                pending.add(executor.submit(*task))
+                if len(pending) >= 2 * args.concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    write_results(done)
+            write_results(pending)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Решено: {counts['solved']}, ошибок: {counts['failed']}", file=sys.stderr)
+    return 0 if not counts["failed"] else 2
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Клиент сервиса TSP; без команды запускается интерактивное меню")
+    commands = parser.add_subparsers(dest="command")
+
+    solve_parser = commands.add_parser("solve", help="решить все матрицы из файла или каталога и записать результаты в NDJSON")
+    solve_parser.add_argument("--input", required=True, help="файл или каталог с матрицами (.csv, .json, .ndjson, .npy)")
+    solve_parser.add_argument("--output", default="-", help="файл результатов NDJSON (по умолчанию stdout)")
+    solve_parser.add_argument("--concurrency", type=int, default=8, help="число одновременных запросов")
+    solve_parser.add_argument("--batch-size", type=int, default=1, help="матриц в одном запросе к /solve/batch (1 = /solve)")
+    solve_parser.add_argument("--options", default=None, help='параметры решателя в JSON, например \'{"time_limit_ms": 5000}\'')
+    solve_parser.add_argument("--server", default=SERVER_URL, help="адрес сервера")
+    solve_parser.add_argument("--login", required=True, help="логин")
+    solve_parser.add_argument("--password", default=None, help="пароль (или переменная окружения TSP_PASSWORD)")
+
+    args = parser.parse_args()
+    if args.command == "solve":
+        sys.exit(bulk_solve(args))
     main_menu()
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,21 +1,123 @@
-from typing import Union, Optional
-from fastapi import FastAPI, HTTPException, Header
-from pydantic import BaseModel
+from typing import Union, Optional, Literal
+from fastapi import FastAPI, HTTPException, Header, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 import json
 import time
 import os
 import random
 import math
 import hashlib
+import hmac
 import secrets
 import string
 from datetime import datetime
 import re
+import sys
+import glob
+import sqlite3
+import heapq
+import itertools
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory, resource_tracker
+import threading
+import uuid
+import atexit
+import asyncio
+import io
+import zlib
+import cProfile
+import pstats
+from contextlib import contextmanager, asynccontextmanager
+from collections import deque
+from collections import OrderedDict
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # solver processes are forked up front, before the server starts taking requests; the stores are opened after
+    # the fork so the workers do not inherit them
+    solver_service.start()
+    get_user_store()
+    get_session_store()
+    get_history_log()
+    yield
+    solver_service.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 LOGS_DIR = 'user_logs/'
 USERS_DIR = 'users/'
+USERS_DB = os.path.join(USERS_DIR, 'users.db')
+SESSIONS_DB = os.path.join(USERS_DIR, 'sessions.db')
+# "memory" keeps sessions in this process only; "sqlite" shares them through SESSIONS_DB between server processes
+SESSION_BACKEND = os.environ.get("TSP_SESSION_BACKEND", "memory")
+SESSION_TTL = 24 * 3600
+SESSION_IDLE_TTL = 3600
+SESSION_MAX_ENTRIES = 10000
+SESSION_SYNC_INTERVAL = 30
+HISTORY_RETENTION = 1000
+HISTORY_PAGE_SIZE = 50
+HISTORY_FLUSH_INTERVAL = 0.5
+HISTORY_FLUSH_BATCH = 256
+HISTORY_COMPACT_INTERVAL = 60
+# below this size the list-based reduction beats numpy's per-call overhead
+NUMPY_MIN_SIZE = 8
+SOLVER_MEMORY_BUDGET_MB = 1024
+WARM_START_STARTS = 10
+HELD_KARP_MAX_N = 20
+# from this size "auto" gives up on a proof of optimality and runs the heuristic within the time limit
+HEURISTIC_MIN_SIZE = 100
+HEURISTIC_TIME_LIMIT_MS = 10000
+HEURISTIC_NEIGHBOURS = 10
+# candidates tried at each level of a Lin–Kernighan chain; its length is the chain's depth
+HEURISTIC_LK_BREADTH = (5, 3)
+HEURISTIC_KICK_SPAN = 50
+HEURISTIC_PATIENCE = 20
+# kept back from a multi-start's time limit for the workers' results to come back
+HEURISTIC_COLLECT_S = 0.05
+SOLVER_WORKERS = int(os.environ.get("TSP_SOLVER_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN_SIZE = 12
+PARALLEL_TASKS_PER_WORKER = 8
+PROGRESS_INTERVAL = 1000
+ONE_TREE_MIN_SIZE = 8
+ONE_TREE_ROOT_ITERATIONS = 300
+ONE_TREE_CHILD_ITERATIONS = 20
+ONE_TREE_CHILD_STEP = 1.0
+ONE_TREE_PATIENCE = 10
+DOMINANCE_MEMORY_MB = float(os.environ.get("TSP_DOMINANCE_MEMORY_MB", 64))
+# an OrderedDict entry with an int key and a float cost, measured at ~165 bytes for 40-city keys
+DOMINANCE_ENTRY_BYTES = 200
+EARTH_RADIUS_KM = 6371.0088
+# points and edge lists are small whatever the size of the instance, so n is capped before the n x n matrix is built
+MAX_CITIES = int(os.environ.get("TSP_MAX_CITIES", 5000))
+CHECKPOINT_DIR = os.environ.get("TSP_CHECKPOINT_DIR", "checkpoints/")
+CHECKPOINT_MAX_BYTES = 256 * 1024 * 1024
+CHECKPOINT_TTL = 7 * 24 * 3600
+JOB_WORKERS = 2
+JOB_QUEUE_LIMIT = 32
+JOB_USER_LIMIT = 4
+JOB_TTL = 3600
+SOLUTION_CACHE_SIZE = 1024
+SOLUTION_CACHE_TTL = 24 * 3600
+SOLUTION_CACHE_DIR = os.environ.get("TSP_SOLUTION_CACHE_DIR")
+SOLVE_SMALL_MAX_N = 20
+SOLVE_SMALL_WORKERS = int(os.environ.get("TSP_SOLVE_SMALL_WORKERS", max((os.cpu_count() or 1) // 2, 1)))
+SOLVE_LARGE_WORKERS = int(os.environ.get("TSP_SOLVE_LARGE_WORKERS", 1))
+SOLVE_QUEUE_PER_WORKER = 4
+SOLVE_CANCEL_POLL = 0.1
+SHARED_MEMORY_MIN_SIZE = 500
+BATCH_MAX_ITEMS = 1000
+STREAM_PROGRESS_INTERVAL_MS = 500
+BINARY_MAX_BYTES = 256 * 1024 * 1024
+PROFILE_TOP_FUNCTIONS = 30
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SOLVE_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800)
+FRONTIER_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
 
 class User(BaseModel):
     login: str
@@ -33,18 +135,264 @@ class AuthResponse(BaseModel):
     token: str
     session_token: str
 
-class TSPRequest(BaseModel):
-    matrix: list[list[float]]
+class TSPSolveOptions(BaseModel):
+    memory_budget_mb: Union[int, None] = Field(None, gt=0)
+    warm_start: Literal["none", "nn", "nn+2opt"] = "nn+2opt"
+    algorithm: Literal["auto", "bnb", "held_karp", "heuristic"] = "auto"
+    time_limit_ms: Union[int, None] = Field(None, gt=0)
+    max_nodes: Union[int, None] = Field(None, ge=0)
+    target_gap: Union[float, None] = Field(None, ge=0)
+    bound: Literal["auto", "reduction", "one_tree"] = "auto"
+    # branch and bound only: save the search every checkpoint_interval_s seconds (and when it is stopped), and with
+    # resume continue from the last checkpoint saved for the same matrix
+    checkpoint_interval_s: Union[float, None] = Field(None, gt=0)
+    resume: bool = False
+
+class TSPRequest(TSPSolveOptions):
+    # The instance is exactly one of: a distance matrix; point coordinates, with distances computed by `metric`
+    # (haversine takes [lat, lon] in degrees and gives kilometres, euc_2d is TSPLIB's rounded euclidean);
+    # or an edge list of [from, to, distance] over num_cities cities, where every edge not listed is forbidden.
+    matrix: Union[list[list[float]], None] = None
+    points: Union[list[list[float]], None] = None
+    metric: Literal["euclidean", "manhattan", "haversine", "euc_2d"] = "euclidean"
+    edges: Union[list[tuple[int, int, float]], None] = None
+    num_cities: Union[int, None] = Field(None, ge=2)
+    directed: bool = False
+
+class TSPBatchRequest(TSPSolveOptions):
+    matrices: list[list[list[float]]]
 
 class TSPResponse(BaseModel):
     distance: Union[float, str]
     path: Union[list[int], None]
+    algorithm: Union[str, None] = None
+    status: Union[Literal["optimal", "limit_reached", "infeasible", "heuristic"], None] = None
+    lower_bound: Union[float, None] = None
+    gap: Union[float, None] = None
+    nodes_explored: Union[int, None] = None
+    cached: bool = False
+    nodes_popped: Union[int, None] = None
+    max_frontier_size: Union[int, None] = None
+    peak_node_memory: Union[int, None] = None
+    heuristic_distance: Union[float, None] = None
+    bound: Union[str, None] = None
+    nodes_pruned: Union[int, None] = None
+    nodes_dominated: Union[int, None] = None
+    resumed: Union[bool, None] = None
+    kicks: Union[int, None] = None
+    solve_time: Union[float, None] = None
+    profile: Union[str, None] = None
+
+class SolveJobResponse(BaseModel):
+    job_id: str
+    status: str
+    progress: Union[dict, None] = None
+    result: Union[TSPResponse, None] = None
+    error: Union[str, None] = None
 
 class ChangePasswordRequest(BaseModel):
     old_password: str
     new_password: str
 
-session_tokens = {}
+class SolveJob:
+    def __init__(self, login: str, tsp_request: TSPRequest):
+        self.id = uuid.uuid4().hex
+        self.login = login
+        self.request = tsp_request
+        self.status = "queued"
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.cancel = threading.Event()
+        self.finished_at = None
+
+    def response(self) -> SolveJobResponse:
+        return SolveJobResponse(job_id=self.id, status=self.status, progress=self.progress, result=self.result, error=self.error)
+
+def format_metric_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+class Metrics:
+    # Counters, gauges and histograms with labels, rendered in the Prometheus text format by /metrics.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.series = {}
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: Optional[tuple] = None):
+        self.kinds[name] = (kind, help_text, buckets)
+        self.series[name] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[name][key] = self.series[name].get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.series[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self.kinds[name][2]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            state = self.series[name].get(key)
+            if state is None:
+                state = self.series[name][key] = [[0] * len(buckets), 0.0, 0]
+            for k, upper in enumerate(buckets):
+                if value <= upper:
+                    state[0][k] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, buckets) in self.kinds.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in self.series[name].items():
+                    if kind != "histogram":
+                        lines.append(f"{name}{format_metric_labels(key)} {value}")
+                        continue
+                    counts, total, count = value
+                    for upper, bucket_count in zip(buckets, counts):
+                        lines.append(f"{name}_bucket{format_metric_labels(key + (('le', upper),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{format_metric_labels(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{format_metric_labels(key)} {total}")
+                    lines.append(f"{name}_count{format_metric_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("tsp_http_requests_total", "counter", "HTTP requests by route and status code")
+metrics.describe("tsp_http_request_duration_seconds", "histogram", "HTTP request latency by route, including streamed bodies", LATENCY_BUCKETS)
+metrics.describe("tsp_signature_check_seconds", "histogram", "Time spent verifying request signatures", LATENCY_BUCKETS)
+metrics.describe("tsp_user_store_seconds", "histogram", "User store operation latency", LATENCY_BUCKETS)
+metrics.describe("tsp_session_store_seconds", "histogram", "Shared session store operation latency", LATENCY_BUCKETS)
+metrics.describe("tsp_sessions", "gauge", "Sessions held in memory")
+metrics.describe("tsp_history_io_seconds", "histogram", "History log I/O latency", LATENCY_BUCKETS)
+metrics.describe("tsp_solve_seconds", "histogram", "Solver wall time by algorithm and result status", SOLVE_BUCKETS)
+metrics.describe("tsp_solver_nodes_explored_total", "counter", "Branch and bound nodes expanded")
+metrics.describe("tsp_solver_nodes_popped_total", "counter", "Branch and bound nodes taken off the frontier")
+metrics.describe("tsp_solver_nodes_pruned_total", "counter", "Branch and bound nodes discarded by their bound")
+metrics.describe("tsp_solver_nodes_dominated_total", "counter", "Branch and bound nodes discarded by a cheaper path to the same state")
+metrics.describe("tsp_solver_max_frontier_size", "histogram", "Largest frontier of a solve", FRONTIER_BUCKETS)
+metrics.describe("tsp_solver_reduction_seconds_total", "counter", "Time spent rebuilding and reducing node matrices")
+metrics.describe("tsp_solver_one_tree_seconds_total", "counter", "Time spent in 1-tree bound subgradient runs")
+metrics.describe("tsp_solver_checkpoints_skipped_total", "counter", "Checkpoints not written because the frontier was over CHECKPOINT_MAX_BYTES")
+metrics.describe("tsp_solution_cache_requests_total", "counter", "Solution cache lookups by result (hit, disk_hit, miss)")
+metrics.describe("tsp_solution_cache_entries", "gauge", "Solutions held in the in-memory cache")
+metrics.describe("tsp_solve_jobs", "gauge", "Background solve jobs by status")
+metrics.describe("tsp_history_pending_entries", "gauge", "History entries waiting to be written")
+metrics.describe("tsp_solver_in_flight", "gauge", "Solves admitted to a solver lane (running or queued)")
+metrics.describe("tsp_solver_rejected_total", "counter", "Solves rejected with 429 because their lane was full")
+
+class RequestMetricsMiddleware:
+    # Plain ASGI middleware rather than @app.middleware("http"), so streamed responses pass through untouched and
+    # their latency covers the whole body.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = route.path if route else "unmatched"
+            metrics.observe("tsp_http_request_duration_seconds", time.perf_counter() - started, method=scope["method"], path=path)
+            metrics.inc("tsp_http_requests_total", method=scope["method"], path=path, status=status)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+class SolutionCache:
+    # In-memory LRU with a TTL, optionally backed by one JSON file per entry in `directory` so that it survives restarts.
+    def __init__(self, max_entries: int, ttl: float, directory: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[0] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1])
+            if entry:
+                del self.entries[key]
+
+        if self.directory and os.path.exists(self.entry_path(key)):
+            try:
+                with open(self.entry_path(key), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                if now - entry["created"] <= self.ttl:
+                    self.remember(key, entry["created"], entry["result"])
+                    with self.lock:
+                        self.hits += 1
+                        self.disk_hits += 1
+                    return dict(entry["result"])
+                os.remove(self.entry_path(key))
+            except (OSError, ValueError, KeyError):
+                pass
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def remember(self, key: str, created: float, result: dict):
+        with self.lock:
+            self.entries[key] = (created, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def put(self, key: str, result: dict):
+        created = time.time()
+        self.remember(key, created, dict(result))
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self.entry_path(key)}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"created": created, "result": result}, f)
+            os.replace(tmp_path, self.entry_path(key))
+
+solution_cache = SolutionCache(SOLUTION_CACHE_SIZE, SOLUTION_CACHE_TTL, SOLUTION_CACHE_DIR)
+
+solve_jobs = {}
+solve_jobs_lock = threading.Lock()
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS)
 
 def validate_password(password):
     if len(password) < 10:
@@ -57,64 +405,396 @@ def validate_password(password):
         return "Пароль должен содержать хотя бы один спецсимвол"
     return None
 
-def get_user_file_path(user: User) -> str:
-    return os.path.join(USERS_DIR, f"user_{user.id}.json")
+class UserStore:
+    # Users live in one SQLite table; lookups by login and token are served from in-memory indexes that are built
+    # on startup and updated by save(). A miss falls through to the (indexed) table, so users created by another
+    # server process are still found.
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "id INTEGER PRIMARY KEY, login TEXT NOT NULL UNIQUE, password TEXT NOT NULL, role TEXT, token TEXT)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS users_token ON users(token)")
+        self.by_login = {}
+        self.by_token = {}
+        self.migrate_json_files(os.path.dirname(db_path) or '.')
+        for row in self.db.execute("SELECT id, login, password, role, token FROM users"):
+            self.index(self.row_to_user(row))
+
+    @staticmethod
+    def row_to_user(row) -> User:
+        return User(id=row[0], login=row[1], password=row[2], role=row[3], token=row[4])
+
+    def index(self, user: User):
+        old = self.by_login.get(user.login)
+        if old and old.token != user.token:
+            self.by_token.pop(old.token, None)
+        self.by_login[user.login] = user
+        if user.token:
+            self.by_token[user.token] = user
+
+    def migrate_json_files(self, directory: str):
+        # one-time import of the old users/user_<id>.json files; imported files are renamed so they are not read again
+        for file_path in glob.glob(os.path.join(directory, "user_*.json")):
+            with open(file_path, 'r') as f:
+                user = User(**json.load(f))
+            with self.lock, self.db:
+                self.db.execute(
+                    "INSERT OR IGNORE INTO users (id, login, password, role, token) VALUES (?, ?, ?, ?, ?)",
+                    (user.id, user.login, user.password, user.role, user.token)
+                )
+            os.replace(file_path, f"{file_path}.migrated")
+
+    def save(self, user: User):
+        with metrics.timer("tsp_user_store_seconds", operation="save"), self.lock:
+            with self.db:
+                self.db.execute(
+                    "INSERT INTO users (id, login, password, role, token) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET login = excluded.login, password = excluded.password, "
+                    "role = excluded.role, token = excluded.token",
+                    (user.id, user.login, user.password, user.role, user.token)
+                )
+            self.index(user.model_copy())
+
+    def lookup(self, index: dict, column: str, value: str) -> Optional[User]:
+        with metrics.timer("tsp_user_store_seconds", operation=f"get_by_{column}"), self.lock:
+            user = index.get(value)
+            if user is None:
+                row = self.db.execute(f"SELECT id, login, password, role, token FROM users WHERE {column} = ?", (value,)).fetchone()
+                if row is None:
+                    return None
+                user = self.row_to_user(row)
+                self.index(user)
+            return user.model_copy()
+
+    def get_by_login(self, login: str) -> Optional[User]:
+        return self.lookup(self.by_login, "login", login)
+
+    def get_by_token(self, token: str) -> Optional[User]:
+        return self.lookup(self.by_token, "token", token)
+
+_stores_lock = threading.Lock()
+_user_store = None
+
+def get_user_store() -> UserStore:
+    # The stores are opened on first use (or by lifespan at startup), never at import: opening the user store creates
+    # USERS_DB and migrates old user files, which `import main` from the benchmark or a script must not do.
+    global _user_store
+    with _stores_lock:
+        if _user_store is None:
+            _user_store = UserStore(USERS_DB)
+        return _user_store
+
+class SQLiteSessionBackend:
+    # Sessions shared between server processes: rows are written on login and read on a local miss or a periodic
+    # sync, never on the per-request path.
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_token TEXT PRIMARY KEY, token TEXT NOT NULL, created REAL NOT NULL, last_seen REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS sessions_token ON sessions(token)")
+
+    def execute(self, operation: str, query: str, params: tuple):
+        with metrics.timer("tsp_session_store_seconds", operation=operation), self.lock, self.db:
+            return self.db.execute(query, params)
+
+    def put(self, session_token: str, token: str, created: float):
+        self.execute("put", "INSERT OR REPLACE INTO sessions (session_token, token, created, last_seen) VALUES (?, ?, ?, ?)",
+                     (session_token, token, created, created))
+        self.execute("purge", "DELETE FROM sessions WHERE created < ? OR last_seen < ?",
+                     (created - SESSION_TTL, created - SESSION_IDLE_TTL))
+
+    def get(self, session_token: str) -> Optional[tuple]:
+        return self.execute("get", "SELECT token, created, last_seen FROM sessions WHERE session_token = ?", (session_token,)).fetchone()
+
+    def touch(self, session_token: str, last_seen: float):
+        self.execute("touch", "UPDATE sessions SET last_seen = MAX(last_seen, ?) WHERE session_token = ?", (last_seen, session_token))
+
+    def delete(self, session_token: str):
+        self.execute("delete", "DELETE FROM sessions WHERE session_token = ?", (session_token,))
+
+    def delete_token(self, token: str):
+        self.execute("delete", "DELETE FROM sessions WHERE token = ?", (token,))
+
+class Session:
+    __slots__ = ("token", "user", "created", "last_seen", "synced_at")
+
+    def __init__(self, token: str, user: User, created: float, last_seen: float, synced_at: float):
+        self.token = token
+        self.user = user
+        self.created = created
+        self.last_seen = last_seen
+        self.synced_at = synced_at
+
+class SessionStore:
+    # Session token -> (technical token, User) as an LRU capped at max_entries, with an absolute TTL and an idle
+    # timeout. With a backend, a session seen here is re-read from it at most every SESSION_SYNC_INTERVAL seconds,
+    # which publishes our last_seen and picks up logins and revocations made by other processes.
+    def __init__(self, max_entries: int, ttl: float, idle_ttl: float, backend: Optional[SQLiteSessionBackend] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self.backend = backend
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def remember(self, session_token: str, session: Session):
+        with self.lock:
+            self.sessions[session_token] = session
+            self.sessions.move_to_end(session_token)
+            while len(self.sessions) > self.max_entries:
+                self.sessions.popitem(last=False)
+
+    def forget(self, session_token: str):
+        with self.lock:
+            self.sessions.pop(session_token, None)
+        if self.backend:
+            self.backend.delete(session_token)
+
+    def create(self, session_token: str, user: User):
+        now = time.time()
+        if self.backend:
+            self.backend.put(session_token, user.token, now)
+        self.remember(session_token, Session(user.token, user.model_copy(), now, now, now))
+
+    def get(self, session_token: str) -> Optional[Session]:
+        now = time.time()
+        with self.lock:
+            session = self.sessions.get(session_token)
+            if session is not None and now - session.created <= self.ttl:
+                idle = now - session.last_seen > self.idle_ttl
+                if self.backend is None or (not idle and now - session.synced_at < SESSION_SYNC_INTERVAL):
+                    if idle:
+                        session = None
+                    else:
+                        self.sessions.move_to_end(session_token)
+                        return session
+        if self.backend is None:
+            if session_token in self.sessions:
+                self.forget(session_token)
+            return None
+
+        row = self.backend.get(session_token)
+        if row is None:
+            self.forget(session_token)
+            return None
+        token, created, last_seen = row
+        if session is not None:
+            last_seen = max(last_seen, session.last_seen)
+        if now - created > self.ttl or now - last_seen > self.idle_ttl:
+            self.forget(session_token)
+            return None
+        user = session.user if session is not None and session.token == token else get_user_store().get_by_token(token)
+        if user is None:
+            self.forget(session_token)
+            return None
+        self.backend.touch(session_token, last_seen)
+        session = Session(token, user, created, last_seen, now)
+        self.remember(session_token, session)
+        return session
+
+    def user_saved(self, user: User):
+        # sessions keep a copy of their user; a changed technical token ends them
+        with self.lock:
+            for session_token, session in list(self.sessions.items()):
+                if session.user.login == user.login:
+                    if session.token == user.token:
+                        session.user = user.model_copy()
+                    else:
+                        del self.sessions[session_token]
+
+    def revoke_token(self, token: str):
+        with self.lock:
+            for session_token in [key for key, session in self.sessions.items() if session.token == token]:
+                del self.sessions[session_token]
+        if self.backend:
+            self.backend.delete_token(token)
+
+_session_store = None
+
+def get_session_store() -> SessionStore:
+    global _session_store
+    with _stores_lock:
+        if _session_store is None:
+            _session_store = SessionStore(SESSION_MAX_ENTRIES, SESSION_TTL, SESSION_IDLE_TTL,
+                                          SQLiteSessionBackend(SESSIONS_DB) if SESSION_BACKEND == "sqlite" else None)
+        return _session_store
 
 def save_user(user: User):
-    if not os.path.exists(USERS_DIR):
-        os.makedirs(USERS_DIR)
-    with open(get_user_file_path(user), 'w') as f:
-        json.dump(user.model_dump(), f)
+    get_user_store().save(user)
+    get_session_store().user_saved(user)
 
 def get_user_log_path(login: str) -> str:
+    return os.path.join(LOGS_DIR, f"{login}_history.ndjson")
+
+def get_legacy_user_log_path(login: str) -> str:
     return os.path.join(LOGS_DIR, f"{login}_history.json")
 
-def load_user_history(login: str) -> list:
-    log_path = get_user_log_path(login)
-    if not os.path.exists(log_path): return []
-    try:
-        with open(log_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+class HistoryLog:
+    # Each user's history is an append-only file with one JSON record per line. add() only queues the record;
+    # a background thread appends queued records in batches and trims files that grew past HISTORY_RETENTION.
+    def __init__(self):
+        self.pending = {}
+        self.pending_count = 0
+        self.pending_lock = threading.Lock()
+        self.user_locks = {}
+        self.user_locks_lock = threading.Lock()
+        self.dirty = set()
+        self.wakeup = threading.Event()
+        self.last_compaction = time.time()
+        self.worker = threading.Thread(target=self.run, name="history-writer", daemon=True)
+        self.worker.start()
+        atexit.register(self.flush)
+
+    def user_lock(self, login: str) -> threading.Lock:
+        with self.user_locks_lock:
+            return self.user_locks.setdefault(login, threading.Lock())
+
+    def add(self, login: str, action: str, details: str = ""):
+        entry = {
+            "id": time.time_ns(),
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "action": action,
+            "details": details
+        }
+        with self.pending_lock:
+            self.pending.setdefault(login, []).append(entry)
+            self.pending_count += 1
+            if self.pending_count >= HISTORY_FLUSH_BATCH:
+                self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(HISTORY_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+                if time.time() - self.last_compaction >= HISTORY_COMPACT_INTERVAL:
+                    self.compact()
+            except OSError:
+                pass
+
+    def take_pending(self, login: Optional[str] = None) -> dict:
+        with self.pending_lock:
+            if login is None:
+                pending, self.pending = self.pending, {}
+            else:
+                pending = {login: self.pending.pop(login)} if login in self.pending else {}
+            self.pending_count -= sum(len(entries) for entries in pending.values())
+            return pending
+
+    def migrate_legacy(self, login: str):
+        # the old format was a single JSON array rewritten on every action
+        legacy_path = get_legacy_user_log_path(login)
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            entries = []
+        with open(get_user_log_path(login), 'a', encoding='utf-8') as f:
+            for number, entry in enumerate(entries):
+                entry.setdefault("id", number)
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.remove(legacy_path)
+
+    def flush(self, login: Optional[str] = None):
+        pending = self.take_pending(login)
+        if not pending:
+            return
+        with metrics.timer("tsp_history_io_seconds", operation="flush"):
+            for user_login, entries in pending.items():
+                with self.user_lock(user_login):
+                    os.makedirs(LOGS_DIR, exist_ok=True)
+                    self.migrate_legacy(user_login)
+                    with open(get_user_log_path(user_login), 'a', encoding='utf-8') as f:
+                        f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+                self.dirty.add(user_login)
 
-def save_user_history(login: str, history: list):
-    if not os.path.exists(LOGS_DIR): os.makedirs(LOGS_DIR)
-    log_path = get_user_log_path(login)
-    with open(log_path, 'w', encoding='utf-8') as f:
-        json.dump(history, f, indent=4, ensure_ascii=False)
+    def compact(self):
+        with metrics.timer("tsp_history_io_seconds", operation="compact"):
+            self.last_compaction = time.time()
+            dirty, self.dirty = self.dirty, set()
+            for login in dirty:
+                with self.user_lock(login):
+                    log_path = get_user_log_path(login)
+                    if not os.path.exists(log_path):
+                        continue
+                    with open(log_path, 'r', encoding='utf-8') as f:
+                        lines = deque(f, maxlen=HISTORY_RETENTION + 1)
+                    if len(lines) <= HISTORY_RETENTION:
+                        continue
+                    lines.popleft()
+                    tmp_path = f"{log_path}.tmp"
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.writelines(lines)
+                    os.replace(tmp_path, log_path)
+
+    def load(self, login: str, limit: int = HISTORY_PAGE_SIZE, before: Optional[int] = None) -> tuple[list, Optional[int]]:
+        # Returns up to `limit` newest entries older than `before` (an entry id), oldest first, plus the cursor
+        # for the previous page (None when there is nothing older).
+        self.flush(login)
+        with metrics.timer("tsp_history_io_seconds", operation="load"), self.user_lock(login):
+            self.migrate_legacy(login)
+            log_path = get_user_log_path(login)
+            if not os.path.exists(log_path):
+                return [], None
+            page = deque(maxlen=limit + 1)
+            with open(log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if before is None or entry.get("id", 0) < before:
+                        page.append(entry)
+        has_more = len(page) > limit
+        if has_more:
+            page.popleft()
+        history = list(page)
+        return history, (history[0]["id"] if has_more and history else None)
+
+    def delete(self, login: str):
+        with metrics.timer("tsp_history_io_seconds", operation="delete"):
+            self.take_pending(login)
+            with self.user_lock(login):
+                for log_path in (get_user_log_path(login), get_legacy_user_log_path(login)):
+                    if os.path.exists(log_path):
+                        os.remove(log_path)
+
+_history_log = None
+
+def get_history_log() -> HistoryLog:
+    # starts the writer thread, so like the stores it is created on first use
+    global _history_log
+    with _stores_lock:
+        if _history_log is None:
+            _history_log = HistoryLog()
+        return _history_log
+
+def load_user_history(login: str, limit: int = HISTORY_PAGE_SIZE, before: Optional[int] = None) -> tuple[list, Optional[int]]:
+    return get_history_log().load(login, limit, before)
 
 def add_user_history(user_login: str, action: str, details: str = ""):
-    history = load_user_history(user_login)
-    history.append({
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "action": action,
-        "details": details
-    })
-    if len(history) > 50: history = history[-50:]
-    save_user_history(user_login, history)
+    get_history_log().add(user_login, action, details)
 
 def is_login_taken(login:str) -> bool:
-    if not os.path.exists(USERS_DIR): return False
-    for file in os.listdir(USERS_DIR):
-        if file.endswith('.json'):
-            with open(f"{USERS_DIR}/{file}", 'r') as f:
-                user_data = json.load(f)
-                if user_data.get('login') == login:
-                    return True
-    return False
+    return get_user_store().get_by_login(login) is not None
 
 def get_user_by_token(token: str) -> Optional[User]:
-    if not os.path.exists(USERS_DIR): return None
-    for file in os.listdir(USERS_DIR):
-        if file.endswith('.json'):
-            with open(f"{USERS_DIR}/{file}", 'r') as f:
-                user_data = json.load(f)
-                if user_data.get('token') == token:
-                    return User(**user_data)
-    return None
+    return get_user_store().get_by_token(token)
 
-def verify_signature(authorization: Optional[str], x_session_token: Optional[str], x_signature_time: Optional[str], request_body: str, time_window: int = 300) -> Optional[User]:
+def verify_signature(authorization: Optional[str], x_session_token: Optional[str], x_signature_time: Optional[str], request_body: Union[str, bytes], time_window: int = 300) -> Optional[User]:
     if not authorization or not authorization.startswith("Bearer "): return None
     if not x_session_token: return None
     if not x_signature_time: return None
@@ -128,24 +808,31 @@ def verify_signature(authorization: Optional[str], x_session_token: Optional[str
     current_time = int(time.time())
     
     if abs(current_time - received_time) > time_window: return None
-    if x_session_token not in session_tokens: return None
+    session = get_session_store().get(x_session_token)
+    if session is None: return None
     
-    technical_token = session_tokens[x_session_token]
-    expected_hash = hashlib.sha256(f"{x_session_token}_{request_body}_{received_time}".encode()).hexdigest()
+    with metrics.timer("tsp_signature_check_seconds"):
+        if isinstance(request_body, bytes):
+            # same message as for text bodies, without decoding the body first
+            expected_hash = hashlib.sha256(f"{x_session_token}_".encode() + request_body + f"_{received_time}".encode()).hexdigest()
+        else:
+            expected_hash = hashlib.sha256(f"{x_session_token}_{request_body}_{received_time}".encode()).hexdigest()
     
-    if received_hash == expected_hash:
-        return get_user_by_token(technical_token)
+    if hmac.compare_digest(received_hash.encode(), expected_hash.encode()):
+        session.last_seen = current_time
+        return session.user.model_copy()
     return None
 
 def reduce_matrix(matrix):
-    reduction = 0
     n = len(matrix)
+    row_reduction = [0] * n
+    col_reduction = [0] * n
     for i in range(n):
         row = [x for x in matrix[i] if x != math.inf]
         if row:
             min_val = min(row)
             if min_val > 0:
-                reduction += min_val
+                row_reduction[i] = min_val
                 for j in range(n):
                     if matrix[i][j] != math.inf:
                         matrix[i][j] -= min_val
@@ -154,18 +841,204 @@ def reduce_matrix(matrix):
         if col:
             min_val = min(col)
             if min_val > 0:
-                reduction += min_val
+                col_reduction[j] = min_val
                 for i in range(n):
                     if matrix[i][j] != math.inf:
                         matrix[i][j] -= min_val
-    return matrix, reduction
+    return matrix, row_reduction, col_reduction
+
+def reduce_matrix_np(matrix: np.ndarray):
+    row_min = matrix.min(axis=1)
+    row_min[row_min == np.inf] = 0
+    matrix -= row_min[:, None]
+    col_min = matrix.min(axis=0)
+    col_min[col_min == np.inf] = 0
+    matrix -= col_min
+    return matrix, row_min, col_min
 
-def solve_tsp_internal(matrix):
+def matrix_minima(matrix):
+    # per row: column of the minimum and the second smallest value; per column: row of the minimum
     n = len(matrix)
-    
+    row_argmin, row_second = [0] * n, [math.inf] * n
+    for i in range(n):
+        order = sorted(range(n), key=matrix[i].__getitem__)
+        row_argmin[i], row_second[i] = order[0], matrix[i][order[1]]
+    col_argmin = [min(range(n), key=lambda i: matrix[i][j]) for j in range(n)]
+    return row_argmin, row_second, col_argmin
+
+def matrix_minima_np(matrix: np.ndarray):
+    return matrix.argmin(axis=1).tolist(), np.partition(matrix, 1, axis=1)[:, 1].tolist(), matrix.argmin(axis=0).tolist()
+
+def rebuild_matrix(processed, path: list[int], row_reduction, col_reduction):
+    n = len(processed)
+    blocked_rows = set(path[:-1])
+    blocked_cols = set(path[1:])
+    matrix = [
+        [math.inf if i in blocked_rows or j in blocked_cols else processed[i][j] - row_reduction[i] - col_reduction[j] for j in range(n)]
+        for i in range(n)
+    ]
+    for k in range(len(path) - 1):
+        matrix[path[k + 1]][path[k]] = math.inf
+    return matrix
+
+def rebuild_matrix_np(processed: np.ndarray, path: list[int], row_reduction: np.ndarray, col_reduction: np.ndarray) -> np.ndarray:
+    matrix = processed - row_reduction[:, None] - col_reduction[None, :]
+    cities = np.array(path)
+    matrix[cities[:-1], :] = np.inf
+    matrix[:, cities[1:]] = np.inf
+    matrix[cities[1:], cities[:-1]] = np.inf
+    return matrix
+
+class SearchNode:
+    # Instead of a reduced N x N matrix a node keeps the cumulative row/column reductions applied on the way
+    # from the root, which together with the path is enough to rebuild the matrix when the node is expanded.
+    __slots__ = ("parent", "city", "depth", "visited", "cost", "bound", "reduction_bound", "row_reduction", "col_reduction", "penalties")
+
+    def __init__(self, parent, city: int, cost: float, bound: float, row_reduction, col_reduction, penalties=None, reduction_bound=None):
+        self.parent = parent
+        self.city = city
+        self.depth = parent.depth + 1 if parent else 1
+        self.visited = (parent.visited if parent else 0) | (1 << city)
+        self.cost = cost
+        self.bound = bound
+        # Little's bound alone, which the children's bounds are built from; bound may be higher with the 1-tree bound
+        self.reduction_bound = bound if reduction_bound is None else reduction_bound
+        self.row_reduction = row_reduction
+        self.col_reduction = col_reduction
+        # Lagrangian node penalties of the 1-tree bound, the starting point for the children's subgradient runs
+        self.penalties = penalties
+
+    def path(self) -> list[int]:
+        path = []
+        node = self
+        while node:
+            path.append(node.city)
+            node = node.parent
+        path.reverse()
+        return path
+
+    def release(self):
+        # expanded nodes stay alive only as path links of their children
+        self.row_reduction = None
+        self.col_reduction = None
+        self.penalties = None
+
+def memory_budget_bytes(memory_budget_mb: Optional[float] = None) -> int:
+    return int(min(memory_budget_mb or SOLVER_MEMORY_BUDGET_MB, SOLVER_MEMORY_BUDGET_MB) * 1024 * 1024)
+
+def node_memory(node: SearchNode) -> int:
+    size = sys.getsizeof(node)
+    for reduction in (node.row_reduction, node.col_reduction, node.penalties):
+        size += sys.getsizeof(reduction)
+        if isinstance(reduction, list):
+            size += sum(sys.getsizeof(x) for x in reduction)
+    return size
+
+def tour_cost(processed, tour: list[int]) -> float:
+    return sum(processed[tour[k - 1]][tour[k]] for k in range(len(tour)))
+
+def nearest_neighbour_tour(processed, start: int) -> Optional[list[int]]:
+    n = len(processed)
+    tour = [start]
+    unvisited = set(range(n)) - {start}
+    while unvisited:
+        row = processed[tour[-1]]
+        next_city = min(unvisited, key=lambda city: row[city])
+        if row[next_city] == math.inf:
+            return None
+        tour.append(next_city)
+        unvisited.remove(next_city)
+    return tour
+
+def two_opt(processed, tour: list[int]) -> list[int]:
+    n = len(tour)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 2):
+            a, b = tour[i], tour[i + 1]
+            # change in cost of the edges inside tour[i+1..j] when they are walked backwards (non-zero for asymmetric matrices)
+            reverse_delta = 0.0
+            for j in range(i + 2, n):
+                reverse_delta += processed[tour[j]][tour[j - 1]] - processed[tour[j - 1]][tour[j]]
+                c, d = tour[j], tour[(j + 1) % n]
+                if d == a:
+                    continue
+                delta = processed[a][c] + processed[b][d] - processed[a][b] - processed[c][d] + reverse_delta
+                if delta < -1e-9:
+                    tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+                    improved = True
+                    break
+    return tour
+
+def or_opt(processed, tour: list[int]) -> list[int]:
+    n = len(tour)
+    improved = True
+    while improved:
+        improved = False
+        for segment_len in (1, 2, 3):
+            for i in range(n - segment_len + 1):
+                segment = tour[i:i + segment_len]
+                prev, next_ = tour[i - 1], tour[(i + segment_len) % n]
+                if prev in segment or next_ in segment:
+                    continue
+                removal_gain = processed[prev][segment[0]] + processed[segment[-1]][next_] - processed[prev][next_]
+                rest = tour[:i] + tour[i + segment_len:]
+                for k in range(len(rest)):
+                    u, v = rest[k], rest[(k + 1) % len(rest)]
+                    if u == prev:
+                        continue
+                    if processed[u][segment[0]] + processed[segment[-1]][v] - processed[u][v] < removal_gain - 1e-9:
+                        tour[:] = rest[:k + 1] + segment + rest[k + 1:]
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return tour
+
+def warm_start_tour(processed, mode: str):
+    n = len(processed)
+    if mode == "none" or n < 3:
+        return math.inf, None
+
+    best_cost, best_tour = math.inf, None
+    starts = range(n) if n <= WARM_START_STARTS else range(0, n, math.ceil(n / WARM_START_STARTS))
+    for start in starts:
+        tour = nearest_neighbour_tour(processed, start)
+        if tour is None:
+            continue
+        if mode == "nn+2opt" and n >= 4:
+            cost = tour_cost(processed, tour)
+            while True:
+                or_opt(processed, two_opt(processed, tour))
+                new_cost = tour_cost(processed, tour)
+                if new_cost >= cost:
+                    break
+                cost = new_cost
+        cost = tour_cost(processed, tour)
+        if cost < best_cost:
+            best_cost, best_tour = cost, tour
+
+    if best_tour is None:
+        return math.inf, None
+    zero = best_tour.index(0)
+    return best_cost, best_tour[zero:] + best_tour[:zero] + [0]
+
+def process_matrix(matrix):
+    if isinstance(matrix, np.ndarray):
+        if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+            raise ValueError("Матрица должна быть квадратной (N x N)")
+        dist = matrix.astype(float)
+        np.fill_diagonal(dist, math.inf)
+        return dist.tolist()
+
+    n = len(matrix)
+
     if any(len(row) != n for row in matrix):
         raise ValueError("Матрица должна быть квадратной (N x N)")
-        
+
     processed = []
     for i in range(n):
         row = []
@@ -175,58 +1048,1033 @@ def solve_tsp_internal(matrix):
             else:
                 row.append(matrix[i][j])
         processed.append(row)
-    
-    best_cost = math.inf  
-    best_path = None      
-    queue = []            
-    start_matrix = [row[:] for row in processed]  
-    reduced, bound = reduce_matrix(start_matrix)   
-    
-    queue.append((bound, 0, [0], reduced))
-    
-    while queue:
-        min_idx = 0
-        for i in range(1, len(queue)):
-            if queue[i][0] < queue[min_idx][0]:
-                min_idx = i
-        bound, cost, path, node_matrix = queue.pop(min_idx)
-        
-        if bound >= best_cost:
-            continue
-            
-        if len(path) == n:
-            total = cost + processed[path[-1]][0]
-            if total < best_cost:
-                best_cost = total
-                best_path = path + [0]  
-            continue
-            
-        current_city = path[-1]  
-        
+    return processed
+
+def is_symmetric(processed) -> bool:
+    dist = np.array(processed, dtype=float)
+    return bool(np.allclose(dist, dist.T))
+
+def one_tree(weights: np.ndarray, forced: Optional[int] = None):
+    # Minimum 1-tree over local cities 0..m-1 with city 0 as the special node: a spanning tree of 1..m-1 plus two
+    # edges from 0, the first of which is 0-forced when given. Returns the weight and the degree of every city.
+    m = len(weights)
+    degree = np.zeros(m, dtype=int)
+    sub = weights[1:, 1:]
+    in_tree = np.zeros(m - 1, dtype=bool)
+    in_tree[0] = True
+    best = sub[0].copy()
+    best[0] = np.inf
+    parent = np.zeros(m - 1, dtype=int)
+    total = 0.0
+    for _ in range(m - 2):
+        j = int(best.argmin())
+        if best[j] == np.inf:
+            return math.inf, degree
+        total += best[j]
+        degree[j + 1] += 1
+        degree[parent[j] + 1] += 1
+        in_tree[j] = True
+        best[j] = np.inf
+        closer = (sub[j] < best) & ~in_tree
+        best[closer] = sub[j][closer]
+        parent[closer] = j
+
+    row = weights[0, 1:].copy()
+    if forced is not None:
+        total += row[forced - 1]
+        degree[forced] += 1
+        row[forced - 1] = np.inf
+        ends = [int(row.argmin())]
+    else:
+        ends = list(np.argpartition(row, 1)[:2])
+    for j in ends:
+        if row[j] == np.inf:
+            return math.inf, degree
+        total += row[j]
+        degree[j + 1] += 1
+    degree[0] = 2
+    return total, degree
+
+def one_tree_bound(dist: np.ndarray, cities: list[int], forced: Optional[int], penalties: np.ndarray, upper: float, iterations: int,
+                   step_scale: float = 2.0):
+    # Held-Karp Lagrangian bound: subgradient ascent on the node penalties of the 1-tree over cities (cities[0] is
+    # the depot). Stops early once the bound reaches upper, i.e. the node can be pruned anyway.
+    # Returns the best bound found and the full-length penalty vector it was found with.
+    weights = dist[np.ix_(cities, cities)]
+    if forced is not None:
+        # the forced edge only closes the path into a cycle, it is not part of the tour
+        weights[0, forced] = weights[forced, 0] = 0.0
+    pi = penalties[cities].copy()
+    best_bound, best_pi = -math.inf, pi
+    stalled = 0
+    for _ in range(iterations):
+        total, degree = one_tree(weights + pi[:, None] + pi[None, :], forced)
+        if total == math.inf:
+            return math.inf, penalties
+        bound = total - 2 * pi.sum()
+        if bound > best_bound + 1e-9:
+            best_bound, best_pi = bound, pi
+            stalled = 0
+        else:
+            stalled += 1
+            if stalled == ONE_TREE_PATIENCE:
+                step_scale /= 2
+                stalled = 0
+        subgradient = degree - 2
+        if best_bound >= upper or not subgradient.any():
+            break
+        target = upper if upper != math.inf else abs(bound) * 1.05 + 1
+        pi = pi + step_scale * (target - bound) / (subgradient @ subgradient) * subgradient
+    new_penalties = penalties.copy()
+    new_penalties[cities] = best_pi
+    return best_bound, new_penalties
+
+class SolveCancelled(Exception):
+    pass
+
+class SolveLimits:
+    __slots__ = ("deadline", "max_nodes", "target_gap")
+
+    def __init__(self, time_limit_ms: Optional[int] = None, max_nodes: Optional[int] = None, target_gap: Optional[float] = None):
+        self.deadline = time.time() + time_limit_ms / 1000 if time_limit_ms else None
+        self.max_nodes = max_nodes
+        self.target_gap = target_gap or 0.0
+
+    def time_left(self) -> float:
+        return self.deadline - time.time() if self.deadline else math.inf
+
+def relative_gap(best_cost: float, lower_bound: float) -> Optional[float]:
+    if best_cost == math.inf:
+        return None
+    if best_cost <= 0:
+        return 0.0
+    return float(max(best_cost - lower_bound, 0.0) / best_cost)
+
+def frontier_bound(queue: list, stack: list[SearchNode]) -> float:
+    return min([entry[0] for entry in queue[:1]] + [node.bound for node in stack], default=math.inf)
+
+class DominanceTable:
+    # Cheapest known cost of a partial tour per (visited set, last city). Partial tours in the same state have the same
+    # completions, so all but the cheapest can be dropped. Holds at most max_bytes worth of states, least recently used
+    # go first; losing an entry only means a dominated node may be expanded after all.
+    def __init__(self, n: int, max_bytes: float):
+        self.n = n
+        self.max_entries = int(max_bytes // DOMINANCE_ENTRY_BYTES)
+        self.costs = OrderedDict()
+
+    def dominated(self, visited: int, city: int, cost: float) -> bool:
+        # for a new node: some other path to the state is at least as cheap
+        best = self.costs.get(visited * self.n + city)
+        if best is not None and best <= cost:
+            self.costs.move_to_end(visited * self.n + city)
+            return True
+        return False
+
+    def superseded(self, node: SearchNode) -> bool:
+        # for a popped node: a cheaper path to its state was found after it was queued
+        best = self.costs.get(node.visited * self.n + node.city)
+        return best is not None and best < node.cost
+
+    def record(self, visited: int, city: int, cost: float):
+        if not self.max_entries:
+            return
+        key = visited * self.n + city
+        self.costs[key] = cost
+        self.costs.move_to_end(key)
+        if len(self.costs) > self.max_entries:
+            self.costs.popitem(last=False)
+
+class BranchAndBound:
+    def __init__(self, processed, memory_budget_mb: Optional[float] = None, limits: Optional[SolveLimits] = None,
+                 incumbent=None, stop=None, cancel=None, progress=None, bound: str = "reduction",
+                 dominance_mb: float = DOMINANCE_MEMORY_MB, checkpoint_path: Optional[str] = None,
+                 checkpoint_interval_s: Optional[float] = None):
+        self.processed = processed
+        self.n = n = len(processed)
+        # "reduction" or "one_tree"; the 1-tree bound is taken on the symmetric min(d[i][j], d[j][i]) matrix, which
+        # keeps it valid (if weak) for asymmetric input, and is combined with the reduction bound by max
+        self.bound = bound
+        if bound == "one_tree":
+            dist = np.array(processed, dtype=float)
+            self.symmetric_dist = np.minimum(dist, dist.T)
+        self.use_numpy = n >= NUMPY_MIN_SIZE
+        self.reduce = reduce_matrix_np if self.use_numpy else reduce_matrix
+        self.minima = matrix_minima_np if self.use_numpy else matrix_minima
+        self.rebuild = rebuild_matrix_np if self.use_numpy else rebuild_matrix
+        self.base_matrix = np.array(processed, dtype=float) if self.use_numpy else processed
+        self.memory_budget_mb = memory_budget_mb
+        self.limits = limits or SolveLimits()
+        # shared multiprocessing.Values of a parallel solve: the best cost over all workers and a flag that stops them
+        self.incumbent = incumbent
+        self.stop = stop
+        # threading.Event checked between expansions, and a callback that gets a progress snapshot every PROGRESS_INTERVAL pops
+        self.cancel = cancel
+        self.progress = progress
+
+        self.best_cost = math.inf
+        self.best_path = None
+        self.nodes_popped = 0
+        self.nodes_explored = 0
+        self.max_frontier_size = 0
+        self.node_bytes = 0
+        self.limit_reached = False
+        # smallest bound among nodes dropped without proving they cannot beat best_cost (target_gap cutoff or a limit)
+        self.pruned_bound = math.inf
+        self.nodes_pruned = 0
+        self.dominance = DominanceTable(n, dominance_mb * 1024 * 1024)
+        self.nodes_dominated = 0
+        # with a checkpoint path the frontier is saved there every checkpoint_interval_s and whenever the search stops early
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval_s = checkpoint_interval_s
+        self.next_checkpoint = time.monotonic() + (checkpoint_interval_s or 0)
+        self.checkpoints_skipped = 0
+        # seconds spent in expand() on the reduction bound (matrix rebuild, minima, child reductions) and on 1-tree bounds
+        self.reduction_time = 0.0
+        self.one_tree_time = 0.0
+
+    @property
+    def cutoff(self) -> float:
+        # nodes at or above the cutoff are pruned; with a target gap that already happens within target_gap of the incumbent
+        return self.best_cost * (1 - self.limits.target_gap) if self.limits.target_gap else self.best_cost
+
+    def lower_bound(self) -> float:
+        return min(self.best_cost, self.pruned_bound)
+
+    def root(self) -> SearchNode:
+        start_matrix = self.base_matrix.copy() if self.use_numpy else [row[:] for row in self.processed]
+        _, row_reduction, col_reduction = self.reduce(start_matrix)
+        reduction_bound = bound = sum(row_reduction) + sum(col_reduction)
+        forbidden = np.isinf(np.array(self.processed, dtype=float))
+        np.fill_diagonal(forbidden, True)
+        if forbidden.all(axis=0).any() or forbidden.all(axis=1).any():
+            # a city without any allowed edge in or out
+            reduction_bound = bound = math.inf
+        penalties = None
+        if self.bound == "one_tree" and self.n >= 3 and bound < math.inf:
+            tree_bound, penalties = one_tree_bound(self.symmetric_dist, list(range(self.n)), None, np.zeros(self.n),
+                                                   self.cutoff, ONE_TREE_ROOT_ITERATIONS)
+            bound = max(bound, tree_bound)
+        return SearchNode(None, 0, 0, bound, row_reduction, col_reduction, penalties, reduction_bound)
+
+    def report(self, frontier_size: int, frontier_bound: float = math.inf):
+        if self.progress:
+            lower_bound = min(self.lower_bound(), frontier_bound)
+            self.progress({
+                "nodes_popped": self.nodes_popped,
+                "nodes_explored": self.nodes_explored,
+                "frontier_size": frontier_size,
+                "best_cost": self.best_cost if self.best_cost != math.inf else None,
+                "best_path": self.best_path,
+                "lower_bound": lower_bound if lower_bound != math.inf else None,
+                "gap": relative_gap(self.best_cost, lower_bound)
+            })
+
+    def improve(self, cost: float, path: list[int]):
+        self.best_cost = cost
+        self.best_path = path
+        if self.incumbent is not None:
+            with self.incumbent.get_lock():
+                if cost < self.incumbent.value:
+                    self.incumbent.value = cost
+
+    def restore_reductions(self, node: SearchNode):
+        # A node from a checkpoint has only its path, cost and bound until it is expanded. Its reductions are then
+        # redone from scratch on the node's matrix, which gives a valid (if possibly different) reduction bound
+        # for the children to build on.
+        zeros = np.zeros(self.n) if self.use_numpy else [0] * self.n
+        node_matrix = self.rebuild(self.base_matrix, node.path(), zeros, zeros)
+        _, node.row_reduction, node.col_reduction = self.reduce(node_matrix)
+        node.reduction_bound = node.cost + sum(node.row_reduction) + sum(node.col_reduction)
+
+    def save_checkpoint(self, nodes: list[SearchNode]):
+        self.next_checkpoint = time.monotonic() + (self.checkpoint_interval_s or 0)
+        if self.checkpoint_path and not save_checkpoint(self.checkpoint_path, self, nodes):
+            self.checkpoints_skipped += 1
+
+    def out_of_limits(self) -> bool:
+        limits = self.limits
+        return bool(
+            (limits.max_nodes is not None and self.nodes_explored >= limits.max_nodes)
+            or (limits.deadline and time.time() >= limits.deadline)
+            or (self.stop is not None and self.stop.get_obj().value)
+        )
+
+    def expand(self, node: SearchNode) -> list[SearchNode]:
+        n, processed = self.n, self.processed
+        if node.row_reduction is None:
+            self.restore_reductions(node)
+        self.nodes_explored += 1
+        started = time.perf_counter()
+        one_tree_time = 0.0
+        node_matrix = self.rebuild(self.base_matrix, node.path(), node.row_reduction, node.col_reduction)
+        row_argmin, row_second, col_argmin = self.minima(node_matrix)
+        matrix = node_matrix.tolist() if self.use_numpy else node_matrix
+        current_city = i = node.city
+        current_row = matrix[current_city]
+        cutoff = self.cutoff
+        children = []
+
+        # The child i -> j is the node matrix with row i, column j and cell (j, i) blocked. The matrix is reduced, so
+        # only a row whose zero was in column j (for row j: in column i) moves up to its second minimum, and only a
+        # column whose zero was in row i (for column i: in row j) needs reducing again - O(n) per child instead of a
+        # copy and a full reduction, and no matrix at all is built for a child.
+        rows_by_argmin = [[] for _ in range(n)]
+        for r in range(n):
+            if r != i and matrix[r][row_argmin[r]] != math.inf:
+                rows_by_argmin[row_argmin[r]].append(r)
+        cols_from_current = [c for c in range(n) if col_argmin[c] == i and current_row[c] != math.inf]
+
         for next_city in range(n):
-            if next_city not in path and node_matrix[current_city][next_city] != math.inf:
-                
-                new_matrix = [row[:] for row in node_matrix]
-                
-                for i in range(n):
-                    new_matrix[current_city][i] = math.inf
-                    new_matrix[i][next_city] = math.inf
-                new_matrix[next_city][current_city] = math.inf
-
-                new_cost = cost + processed[current_city][next_city]
-                new_path = path + [next_city]
-                
-                reduced, reduction = reduce_matrix(new_matrix)
-                new_bound = new_cost + reduction
-                
-                if new_bound < best_cost:
-                    queue.append((new_bound, new_cost, new_path, reduced))
-                    
+            if node.visited >> next_city & 1 or current_row[next_city] == math.inf:
+                continue
+            j = next_city
+
+            row_delta = {r: row_second[r] for r in rows_by_argmin[j]}
+            if row_argmin[j] == i and matrix[j][i] != math.inf:
+                row_delta[j] = row_second[j]
+            # With forbidden edges a row or column can lose its last finite entry: a city that can no longer be left
+            # or entered, so no tour goes through the child. Once every city is visited only j -> 0 has to stay open.
+            completes = node.depth + 1 == n
+            feasible = completes or math.inf not in row_delta.values()
+            row_delta = {r: value for r, value in row_delta.items() if value != math.inf}
+            col_delta = {}
+            cols = [c for c in cols_from_current if c != j]
+            if col_argmin[i] == j and matrix[j][i] != math.inf:
+                cols.append(i)
+            for c in cols if feasible else ():
+                col_min = min((matrix[r][c] - row_delta.get(r, 0) for r in range(n) if r != i and not (c == i and r == j)), default=math.inf)
+                if 0 < col_min < math.inf:
+                    col_delta[c] = col_min
+                elif col_min == math.inf and not completes:
+                    feasible = False
+                    break
+            if not feasible:
+                self.nodes_pruned += 1
+                continue
+
+            new_cost = node.cost + processed[i][j]
+            if self.dominance.dominated(node.visited | 1 << j, j, new_cost):
+                self.nodes_dominated += 1
+                continue
+            reduction_bound = new_bound = node.reduction_bound + current_row[j] + sum(row_delta.values()) + sum(col_delta.values())
+
+            penalties = None
+            if new_bound < cutoff and node.penalties is not None and n - node.depth >= 3:
+                # the rest of the tour is a path next_city -> unvisited -> 0: a cycle over those cities through the free edge 0-next_city
+                cities = [0, next_city] + [city for city in range(n) if not (node.visited | 1 << next_city) >> city & 1]
+                tree_started = time.perf_counter()
+                tree_bound, penalties = one_tree_bound(self.symmetric_dist, cities, 1, node.penalties, cutoff - new_cost,
+                                                       ONE_TREE_CHILD_ITERATIONS, ONE_TREE_CHILD_STEP)
+                one_tree_time += time.perf_counter() - tree_started
+                new_bound = max(new_bound, new_cost + tree_bound)
+
+            if new_bound < cutoff:
+                row_reduction = node.row_reduction.copy()
+                col_reduction = node.col_reduction.copy()
+                for r, value in row_delta.items():
+                    row_reduction[r] += value
+                for c, value in col_delta.items():
+                    col_reduction[c] += value
+                children.append(SearchNode(node, next_city, new_cost, new_bound, row_reduction, col_reduction, penalties, reduction_bound))
+                self.dominance.record(node.visited | 1 << j, j, new_cost)
+            else:
+                self.nodes_pruned += 1
+                if new_bound < self.pruned_bound:
+                    self.pruned_bound = new_bound
+
+        node.release()
+        self.one_tree_time += one_tree_time
+        self.reduction_time += time.perf_counter() - started - one_tree_time
+        return children
+
+    def run(self, roots: list[SearchNode], split_size: Optional[int] = None) -> list[SearchNode]:
+        # With split_size the search stops as soon as the frontier reaches that many nodes and returns them,
+        # so that the subtrees can be handed out to workers; otherwise it runs until the frontier is exhausted
+        # or a limit is hit (see limit_reached / lower_bound()) and returns [].
+        n = self.n
+        if not roots:
+            return []
+
+        # Once the heap reaches the memory budget, new children go to a depth-first stack instead. The stack never
+        # holds more than n nodes per level, so space for it is reserved out of the budget up front.
+        self.node_bytes = node_memory(roots[0])
+        max_heap_nodes = max(memory_budget_bytes(self.memory_budget_mb) // self.node_bytes - n * n, 0)
+
+        # (bound, -depth, seq, node): deeper nodes win ties on bound, seq keeps order stable
+        counter = itertools.count()
+        queue = [(root.bound, -root.depth, next(counter), root) for root in roots]
+        heapq.heapify(queue)
+        stack = []
+        self.max_frontier_size = max(self.max_frontier_size, len(queue))
+
+        while queue or stack:
+            if split_size and len(queue) + len(stack) >= split_size:
+                return [entry[3] for entry in queue] + stack
+
+            if self.out_of_limits():
+                self.limit_reached = True
+                # saved before the frontier counts towards pruned_bound: on resume it is searched, not dropped
+                self.save_checkpoint([entry[3] for entry in queue] + stack)
+                self.pruned_bound = min(self.pruned_bound, frontier_bound(queue, stack))
+                return []
+
+            if self.incumbent is not None and self.incumbent.get_obj().value < self.best_cost:
+                self.best_cost = self.incumbent.get_obj().value
+            # checked on every pop: with the 1-tree bound a thousand pops can take several seconds
+            if self.cancel is not None and self.cancel.is_set():
+                self.save_checkpoint([entry[3] for entry in queue] + stack)
+                raise SolveCancelled()
+            if self.checkpoint_interval_s and time.monotonic() >= self.next_checkpoint:
+                self.save_checkpoint([entry[3] for entry in queue] + stack)
+            if self.nodes_popped % PROGRESS_INTERVAL == 0:
+                self.report(len(queue) + len(stack), frontier_bound(queue, stack))
+
+            if stack:
+                node = stack.pop()
+                self.nodes_popped += 1
+                if node.bound >= self.cutoff:
+                    self.nodes_pruned += 1
+                    self.pruned_bound = min(self.pruned_bound, node.bound)
+                    continue
+            else:
+                node = heapq.heappop(queue)[3]
+                self.nodes_popped += 1
+                # lazy pruning: the heap is ordered by bound, so once the top is past the cutoff nothing left is worth expanding
+                if node.bound >= self.cutoff:
+                    self.nodes_pruned += 1 + len(queue)
+                    self.pruned_bound = min(self.pruned_bound, node.bound)
+                    break
+            if self.dominance.superseded(node):
+                self.nodes_dominated += 1
+                node.release()
+                continue
+
+            if node.depth == n:
+                total = node.cost + self.processed[node.city][0]
+                if total < self.best_cost:
+                    self.improve(total, node.path() + [0])
+                    self.report(len(queue) + len(stack), frontier_bound(queue, stack))
+                continue
+
+            children = self.expand(node)
+            if stack or len(queue) + len(children) > max_heap_nodes:
+                children.sort(key=lambda child: child.bound, reverse=True)
+                stack.extend(children)
+            else:
+                for child in children:
+                    heapq.heappush(queue, (child.bound, -child.depth, next(counter), child))
+
+            if len(queue) + len(stack) > self.max_frontier_size:
+                self.max_frontier_size = len(queue) + len(stack)
+        return []
+
+def save_checkpoint(path: str, search: BranchAndBound, nodes: list[SearchNode]) -> bool:
+    # Frontier nodes are stored as their paths (padded with -1), costs and bounds, plus the 1-tree penalties as float32
+    # (any penalties give a valid bound). Past CHECKPOINT_MAX_BYTES the penalties are left out, and if that is still
+    # too big the previous checkpoint is kept.
+    n = search.n
+    paths = np.full((len(nodes), n), -1, dtype=np.int16)
+    for k, node in enumerate(nodes):
+        node_path = node.path()
+        paths[k, :len(node_path)] = node_path
+    penalties = np.empty((0, n), dtype=np.float32)
+    if search.bound == "one_tree" and paths.nbytes + len(nodes) * n * 4 <= CHECKPOINT_MAX_BYTES:
+        penalties = np.array([node.penalties if node.penalties is not None else np.full(n, np.nan) for node in nodes], dtype=np.float32).reshape(-1, n)
+    if paths.nbytes + penalties.nbytes + len(nodes) * 16 > CHECKPOINT_MAX_BYTES:
+        return False
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, n=n, best_cost=search.best_cost, best_path=np.array(search.best_path or [], dtype=np.int16),
+                 pruned_bound=search.pruned_bound, paths=paths, costs=np.array([node.cost for node in nodes], dtype=float),
+                 bounds=np.array([node.bound for node in nodes], dtype=float), penalties=penalties)
+    os.replace(tmp_path, path)
+    return True
+
+def load_checkpoint(path: str, search: BranchAndBound) -> Optional[list[SearchNode]]:
+    # Takes over the checkpoint's incumbent and pruned bound and returns its frontier, or None if there is no usable
+    # checkpoint. Ancestors are rebuilt once per shared prefix, only as path links; see restore_reductions().
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            checkpoint = {key: data[key] for key in data.files}
+    except (OSError, ValueError, KeyError):
+        return None
+    if int(checkpoint["n"]) != search.n:
+        return None
+    if float(checkpoint["best_cost"]) < search.best_cost:
+        search.best_cost, search.best_path = float(checkpoint["best_cost"]), checkpoint["best_path"].tolist()
+    search.pruned_bound = min(search.pruned_bound, float(checkpoint["pruned_bound"]))
+    # the saved bounds hold for any bound type, the 1-tree penalties are only of use to a one_tree search
+    penalties = checkpoint["penalties"] if search.bound == "one_tree" else np.empty((0, search.n))
+    ancestors = {}
+    nodes = []
+    for k, row in enumerate(checkpoint["paths"]):
+        path = row[row >= 0].tolist()
+        parent = None
+        for city in path[:-1]:
+            key = (id(parent), city)
+            if key not in ancestors:
+                ancestors[key] = SearchNode(parent, city, 0, 0, None, None)
+            parent = ancestors[key]
+        node_penalties = None
+        if len(penalties) and not np.isnan(penalties[k]).any():
+            node_penalties = penalties[k].astype(float)
+        nodes.append(SearchNode(parent, path[-1], float(checkpoint["costs"][k]), float(checkpoint["bounds"][k]), None, None, node_penalties))
+    if nodes:
+        # one full node, so that run() sizes the frontier against the memory budget as usual
+        search.restore_reductions(nodes[0])
+    return nodes
+
+def checkpoint_path(matrix) -> str:
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    now = time.time()
+    for stale_path in glob.glob(os.path.join(CHECKPOINT_DIR, "*.npz")):
+        try:
+            if now - os.path.getmtime(stale_path) > CHECKPOINT_TTL:
+                os.remove(stale_path)
+        except OSError:
+            pass
+    return os.path.join(CHECKPOINT_DIR, f"{matrix_digest(matrix)}.npz")
+
+_worker_incumbent = None
+_worker_stop = None
+
+def init_solver_worker(incumbent, stop):
+    global _worker_incumbent, _worker_stop
+    _worker_incumbent = incumbent
+    _worker_stop = stop
+
+def solve_subtree(processed, node: SearchNode, best_cost: float, memory_budget_mb: Optional[float], limits: SolveLimits, bound: str,
+                  dominance_mb: float):
+    search = BranchAndBound(processed, memory_budget_mb, limits, _worker_incumbent, _worker_stop, bound=bound, dominance_mb=dominance_mb)
+    search.best_cost = best_cost
+    search.run([node])
+    return (search.best_cost, search.best_path, search.nodes_popped, search.nodes_explored, search.max_frontier_size,
+            search.node_bytes, search.limit_reached, search.pruned_bound, search.nodes_pruned, search.nodes_dominated,
+            search.reduction_time, search.one_tree_time)
+
+def run_parallel(search: BranchAndBound, workers: int):
+    # The tree is expanded best-first in this process until there are enough subtrees to keep every worker busy,
+    # then each subtree is solved in the pool; workers publish and read the incumbent through search.incumbent.
+    frontier = search.run([search.root()], split_size=workers * PARALLEL_TASKS_PER_WORKER)
+    if not frontier:
+        return
+    frontier.sort(key=lambda node: (node.bound, -node.depth))
+    worker_budget_mb = (search.memory_budget_mb or SOLVER_MEMORY_BUDGET_MB) / workers
+    limits = search.limits
+    if limits.max_nodes is not None:
+        # the node limit is shared out evenly, so the total over all subtrees stays within it
+        limits = SolveLimits(max_nodes=max((limits.max_nodes - search.nodes_explored) // len(frontier), 0), target_gap=limits.target_gap)
+        limits.deadline = search.limits.deadline
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_solver_worker, initargs=(search.incumbent, search.stop)) as pool:
+        futures = [pool.submit(solve_subtree, search.processed, node, search.best_cost, worker_budget_mb, limits, search.bound,
+                               DOMINANCE_MEMORY_MB / workers) for node in frontier]
+        for done, future in enumerate(futures, 1):
+            while not wait([future], timeout=min(0.1, max(search.limits.time_left(), 0))).done:
+                if search.cancel is not None and search.cancel.is_set():
+                    search.stop.value = 1
+                    for pending in futures:
+                        pending.cancel()
+                    raise SolveCancelled()
+                if search.limits.time_left() <= 0:
+                    search.stop.value = 1
+            (cost, path, nodes_popped, nodes_explored, max_frontier_size, node_bytes, limit_reached, pruned_bound,
+             nodes_pruned, nodes_dominated, reduction_time, one_tree_time) = future.result()
+            if path is not None and cost < search.best_cost:
+                search.best_cost, search.best_path = cost, path
+            search.nodes_popped += nodes_popped
+            search.nodes_explored += nodes_explored
+            search.max_frontier_size = max(search.max_frontier_size, max_frontier_size)
+            search.node_bytes = max(search.node_bytes, node_bytes)
+            search.limit_reached = search.limit_reached or limit_reached
+            search.pruned_bound = min(search.pruned_bound, pruned_bound)
+            search.nodes_pruned += nodes_pruned
+            search.nodes_dominated += nodes_dominated
+            search.reduction_time += reduction_time
+            search.one_tree_time += one_tree_time
+            search.report(len(frontier) - done, min((node.bound for node in frontier[done:]), default=math.inf))
+
+def solve_tsp_internal(matrix, memory_budget_mb: Optional[int] = None, warm_start: str = "nn+2opt", workers: Optional[int] = None,
+                       time_limit_ms: Optional[int] = None, max_nodes: Optional[int] = None, target_gap: Optional[float] = None,
+                       bound: str = "auto", cancel=None, progress=None, checkpoint_interval_s: Optional[float] = None,
+                       resume: bool = False):
+    limits = SolveLimits(time_limit_ms, max_nodes, target_gap)
+    processed = process_matrix(matrix)
+    n = len(processed)
+    workers = workers or SOLVER_WORKERS
+    if bound == "auto":
+        bound = "one_tree" if n >= ONE_TREE_MIN_SIZE and is_symmetric(processed) else "reduction"
+    saved_path = checkpoint_path(matrix) if checkpoint_interval_s or resume else None
+    resumed = False
+
+    heuristic_cost, heuristic_path = warm_start_tour(processed, warm_start)
+    if saved_path:
+        # the frontier of a parallel solve is spread over the workers, so checkpointed solves run in this process
+        search = BranchAndBound(processed, memory_budget_mb, limits, cancel=cancel, progress=progress, bound=bound,
+                                checkpoint_path=saved_path if checkpoint_interval_s else None, checkpoint_interval_s=checkpoint_interval_s)
+        search.best_cost, search.best_path = heuristic_cost, heuristic_path
+        roots = load_checkpoint(saved_path, search) if resume else None
+        resumed = roots is not None
+        search.run([search.root()] if roots is None else roots)
+        if not search.limit_reached and os.path.exists(saved_path):
+            # finished: nothing left to resume
+            os.remove(saved_path)
+    elif workers > 1 and n >= PARALLEL_MIN_SIZE:
+        search = BranchAndBound(processed, memory_budget_mb, limits, multiprocessing.Value("d", heuristic_cost), multiprocessing.Value("b", 0),
+                                cancel, progress, bound)
+        search.best_cost, search.best_path = heuristic_cost, heuristic_path
+        run_parallel(search, workers)
+    else:
+        search = BranchAndBound(processed, memory_budget_mb, limits, cancel=cancel, progress=progress, bound=bound)
+        search.best_cost, search.best_path = heuristic_cost, heuristic_path
+        search.run([search.root()])
+
+    lower_bound = search.lower_bound()
+    if search.limit_reached or lower_bound < search.best_cost:
+        status = "limit_reached"
+    elif search.best_path is None:
+        status = "infeasible"
+    else:
+        status = "optimal"
+    return {
+        "distance": float(search.best_cost) if search.best_path is not None else "No solution",
+        "path": search.best_path,
+        "status": status,
+        "lower_bound": float(lower_bound) if lower_bound != math.inf else None,
+        "gap": relative_gap(search.best_cost, lower_bound) if search.best_path is not None else None,
+        "nodes_explored": search.nodes_explored,
+        "nodes_popped": search.nodes_popped,
+        "nodes_pruned": search.nodes_pruned,
+        "nodes_dominated": search.nodes_dominated,
+        "max_frontier_size": search.max_frontier_size,
+        "peak_node_memory": search.max_frontier_size * search.node_bytes,
+        "heuristic_distance": float(heuristic_cost) if heuristic_cost != math.inf else None,
+        "bound": bound,
+        "reduction_time": search.reduction_time,
+        "one_tree_time": search.one_tree_time,
+        "resumed": resumed,
+        "checkpoints_skipped": search.checkpoints_skipped
+    }
+
+def held_karp_memory(n: int) -> int:
+    # dp (float64) and parent (int8) tables over subsets of cities 1..n-1, plus the mask/popcount index arrays
+    m = max(n - 1, 1)
+    return (1 << m) * (9 * m + 16)
+
+def solve_held_karp(matrix, memory_budget_mb: Optional[int] = None, time_limit_ms: Optional[int] = None, cancel=None, progress=None, **options):
+    n = len(matrix)
+
+    if any(len(row) != n for row in matrix):
+        raise ValueError("Матрица должна быть квадратной (N x N)")
+    if held_karp_memory(n) > memory_budget_bytes(memory_budget_mb):
+        raise ValueError(f"Held-Karp для {n} городов не помещается в лимит памяти")
+
+    dist = np.array(matrix, dtype=float)
+    np.fill_diagonal(dist, np.inf)
+
+    # city k (1..n-1) is bit k-1 of the subset mask; dp[mask, j] is the cheapest path 0 -> ... -> j+1 through mask
+    m = n - 1
+    full = 1 << m
+    cost = dist[1:, 1:]
+    dp = np.full((full, m), np.inf)
+    parent = np.full((full, m), -1, dtype=np.int8)
+    dp[1 << np.arange(m), np.arange(m)] = dist[0, 1:]
+
+    masks = np.arange(full)
+    popcount = np.zeros(full, dtype=np.int8)
+    for bit in range(m):
+        popcount += (masks >> bit) & 1
+
+    limits = SolveLimits(time_limit_ms)
+    for size in range(2, m + 1):
+        if cancel is not None and cancel.is_set():
+            raise SolveCancelled()
+        if limits.time_left() <= 0:
+            # the table is useless until it is complete, so fall back to the best heuristic tour
+            heuristic_cost, heuristic_path = warm_start_tour(process_matrix(matrix), "nn+2opt")
+            return {
+                "distance": float(heuristic_cost) if heuristic_path is not None else "No solution",
+                "path": heuristic_path,
+                "status": "limit_reached",
+                "heuristic_distance": float(heuristic_cost) if heuristic_path is not None else None
+            }
+        if progress:
+            progress({"subset_size": size, "subset_sizes_total": m})
+        layer = masks[popcount == size]
+        for j in range(m):
+            with_j = layer[(layer >> j) & 1 == 1]
+            candidates = dp[with_j ^ (1 << j)] + cost[:, j]
+            best = candidates.argmin(axis=1)
+            dp[with_j, j] = candidates[np.arange(len(with_j)), best]
+            parent[with_j, j] = best
+
+    closing = dp[full - 1] + dist[1:, 0]
+    last = int(closing.argmin())
+    best_cost = float(closing[last])
+    if best_cost == math.inf:
+        return {"distance": "No solution", "path": None, "status": "infeasible"}
+
+    path = []
+    mask, j = full - 1, last
+    while j >= 0:
+        path.append(j + 1)
+        mask, j = mask ^ (1 << j), int(parent[mask, j])
+    return {"distance": best_cost, "path": [0] + path[::-1] + [0], "status": "optimal", "lower_bound": best_cost, "gap": 0.0}
+
+def neighbour_lists(dist: np.ndarray, k: int) -> tuple[list[list[int]], list[list[float]]]:
+    # the k nearest cities of each city by the cheaper direction of the edge, nearest first, with those distances;
+    # forbidden edges are never candidates
+    closeness = np.minimum(dist, dist.T)
+    k = max(min(k, len(dist) - 1), 1)
+    nearest = np.argpartition(closeness, k - 1, axis=1)[:, :k]
+    nearest_dist = np.take_along_axis(closeness, nearest, axis=1)
+    order = nearest_dist.argsort(axis=1)
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    nearest_dist = np.take_along_axis(nearest_dist, order, axis=1)
+    finite = np.isfinite(nearest_dist)
+    return ([row[mask].tolist() for row, mask in zip(nearest, finite)],
+            [row[mask].tolist() for row, mask in zip(nearest_dist, finite)])
+
+def nearest_neighbour_np(dist: np.ndarray, start: int, deadline: float) -> list[int]:
+    # past the deadline the remaining cities are appended in index order, the local search can still repair them
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    tour = [start]
+    for step in range(n - 1):
+        if step % 64 == 0 and time.time() >= deadline:
+            tour.extend(np.flatnonzero(~visited).tolist())
+            break
+        row = np.where(visited, np.inf, dist[tour[-1]])
+        city = int(row.argmin())
+        if row[city] == np.inf:
+            city = int(np.flatnonzero(~visited)[0])
+        visited[city] = True
+        tour.append(city)
+    return tour
+
+class LocalSearch:
+    # Neighbour-list local search over a tour kept as a city list plus each city's position in it. Cities whose
+    # edges changed go back into a queue (the rest have their don't-look bit set) and each is tried with 2-opt,
+    # Or-opt and a Lin–Kernighan step; the search stops when the queue is empty or at the deadline. Moves that walk a
+    # segment backwards are only used on symmetric matrices, asymmetric ones get Or-opt and segment swaps.
+    def __init__(self, dist: list[list[float]], neighbours: list[list[int]], closeness: list[list[float]], symmetric: bool,
+                 tour: list[int], deadline: float, stop=None, cancel=None):
+        self.dist = dist
+        self.neighbours = neighbours
+        self.closeness = closeness
+        self.symmetric = symmetric
+        self.n = len(tour)
+        self.tour = tour
+        self.pos = [0] * self.n
+        self.reindex()
+        self.deadline = deadline
+        self.stop = stop
+        self.cancel = cancel
+        self.queue = deque()
+        self.queued = [False] * self.n
+        self.touched = []
+        self.delta = 0.0
+        self.moves = 0
+
+    def reindex(self):
+        pos = self.pos
+        for i, city in enumerate(self.tour):
+            pos[city] = i
+
+    def succ(self, city: int) -> int:
+        return self.tour[(self.pos[city] + 1) % self.n]
+
+    def pred(self, city: int) -> int:
+        return self.tour[self.pos[city] - 1]
+
+    def expired(self) -> bool:
+        return (time.time() >= self.deadline or (self.stop is not None and self.stop.value)
+                or (self.cancel is not None and self.cancel.is_set()))
+
+    def push(self, cities):
+        for city in cities:
+            if not self.queued[city]:
+                self.queued[city] = True
+                self.queue.append(city)
+
+    def reverse(self, i: int, j: int):
+        # reverses the tour from position i forward to position j; on a symmetric matrix the rest of the tour is
+        # reversed instead when it is shorter, which gives the same cycle
+        tour, pos, n = self.tour, self.pos, self.n
+        length = (j - i) % n + 1
+        if self.symmetric and 2 * length > n:
+            i, j, length = (j + 1) % n, (i - 1) % n, n - length
+        for _ in range(length // 2):
+            a, b = tour[i], tour[j]
+            tour[i], tour[j] = b, a
+            pos[a], pos[b] = j, i
+            i = (i + 1) % n
+            j = (j - 1) % n
+
+    def two_opt(self, a: int) -> bool:
+        dist = self.dist
+        for forward in (True, False):
+            b = self.succ(a) if forward else self.pred(a)
+            removed = dist[a][b]
+            for c, closeness in zip(self.neighbours[a], self.closeness[a]):
+                if closeness >= removed:
+                    break
+                d = self.succ(c) if forward else self.pred(c)
+                if c == b or d == a:
+                    continue
+                delta = dist[a][c] + dist[b][d] - removed - dist[c][d]
+                if delta < -1e-9:
+                    if forward:
+                        self.reverse(self.pos[b], self.pos[c])
+                    else:
+                        self.reverse(self.pos[a], self.pos[d])
+                    self.touched = [a, b, c, d]
+                    self.delta += delta
+                    return True
+        return False
+
+    def or_opt(self, a: int) -> bool:
+        # moves the segment of 1-3 cities starting at a next to one of a's neighbours: after c (kept in order) or,
+        # on a symmetric matrix, before c (reversed)
+        dist, tour, n = self.dist, self.tour, self.n
+        for length in (1, 2, 3):
+            if length > n - 3:
+                break
+            first = self.pos[a]
+            last_city = tour[(first + length - 1) % n]
+            segment = {tour[(first + k) % n] for k in range(length)}
+            p, nx = self.pred(a), self.succ(last_city)
+            removal_gain = dist[p][a] + dist[last_city][nx] - dist[p][nx]
+            if not removal_gain > 1e-9:
+                continue
+            for c, closeness in zip(self.neighbours[a], self.closeness[a]):
+                if closeness >= removal_gain:
+                    break
+                if c in segment:
+                    continue
+                d = self.succ(c)
+                if d not in segment and dist[c][a] + dist[last_city][d] - dist[c][d] < removal_gain - 1e-9:
+                    self.delta += dist[c][a] + dist[last_city][d] - dist[c][d] - removal_gain
+                    self.move_segment(first, length, c, False)
+                    self.touched = [p, nx, a, last_city, c, d]
+                    return True
+                d = self.pred(c)
+                if self.symmetric and d not in segment and dist[d][last_city] + dist[a][c] - dist[d][c] < removal_gain - 1e-9:
+                    self.delta += dist[d][last_city] + dist[a][c] - dist[d][c] - removal_gain
+                    self.move_segment(first, length, d, True)
+                    self.touched = [p, nx, a, last_city, c, d]
+                    return True
+        return False
+
+    def move_segment(self, first: int, length: int, after: int, backwards: bool):
+        rotated = self.tour[first:] + self.tour[:first]
+        segment, rest = rotated[:length], rotated[length:]
+        if backwards:
+            segment.reverse()
+        k = rest.index(after) + 1
+        self.tour[:] = rest[:k] + segment + rest[k:]
+        self.reindex()
+
+    def lin_kernighan(self, t1: int, t2: int, delta: float = 0.0, depth: int = 0) -> bool:
+        # A chain of 2-opt moves: break t1-t2, join t2 to a near city t3 and break t3-t4, which leaves the tour
+        # closed by t4-t1. A step that does not pay for itself is kept tentatively while the gain so far is
+        # positive and the chain goes on from t4 (the HEURISTIC_LK_BREADTH best candidates per level, to its depth);
+        # it is undone unless some closed tour along it is shorter than the starting one.
+        dist = self.dist
+        forward = self.succ(t1) == t2
+        removed = dist[t1][t2] - delta
+        candidates = []
+        for t3, closeness in zip(self.neighbours[t2], self.closeness[t2]):
+            if closeness >= removed:
+                break
+            t4 = self.pred(t3) if forward else self.succ(t3)
+            if t3 == t1 or t4 == t2:
+                continue
+            step = dist[t2][t3] + dist[t4][t1] - dist[t1][t2] - dist[t3][t4]
+            if delta + step < -1e-9:
+                self.lk_reverse(t2, t4, forward)
+                self.touched.extend((t1, t2, t3, t4))
+                self.delta += delta + step
+                return True
+            # what the next level may spend on its first new edge; not enough for t4's nearest city ends the chain
+            remaining = removed - dist[t2][t3] + dist[t3][t4]
+            if self.closeness[t4] and remaining > self.closeness[t4][0]:
+                candidates.append((remaining, t3, t4, step))
+        if depth >= len(HEURISTIC_LK_BREADTH):
+            return False
+        candidates.sort(reverse=True)
+        for _, t3, t4, step in candidates[:HEURISTIC_LK_BREADTH[depth]]:
+            i, j = self.lk_reverse(t2, t4, forward)
+            if self.lin_kernighan(t1, t4, delta + step, depth + 1):
+                self.touched.extend((t2, t3, t4))
+                return True
+            self.reverse(i, j)
+        return False
+
+    def lk_reverse(self, t2: int, t4: int, forward: bool) -> tuple[int, int]:
+        i, j = (self.pos[t2], self.pos[t4]) if forward else (self.pos[t4], self.pos[t2])
+        self.reverse(i, j)
+        return i, j
+
+    def improve(self, city: int) -> bool:
+        self.touched = []
+        if self.symmetric:
+            if self.two_opt(city) or self.or_opt(city):
+                return True
+            return self.lin_kernighan(city, self.succ(city)) or self.lin_kernighan(city, self.pred(city))
+        return self.or_opt(city)
+
+    def optimize(self) -> bool:
+        # returns False when stopped by the deadline before reaching a local optimum
+        while self.queue:
+            if self.expired():
+                return False
+            city = self.queue.popleft()
+            self.queued[city] = False
+            if self.improve(city):
+                self.moves += 1
+                self.push(self.touched)
+        return True
+
+    def segment_swap(self, rng: random.Random) -> bool:
+        # The kick between local searches: two adjacent segments of at most HEURISTIC_KICK_SPAN cities in total
+        # change places, a double bridge whose changes stay close together in the tour (and keep its direction).
+        # Kicks that would use a forbidden edge are not made.
+        dist, tour, pos, n = self.dist, self.tour, self.pos, self.n
+        first = rng.randrange(n)
+        x, y = sorted(rng.sample(range(1, min(HEURISTIC_KICK_SPAN, n - 2) + 1), 2))
+        a, b0, b1 = tour[first], tour[(first + 1) % n], tour[(first + x) % n]
+        c0, c1, d = tour[(first + x + 1) % n], tour[(first + y) % n], tour[(first + y + 1) % n]
+        delta = dist[a][c0] + dist[c1][b0] + dist[b1][d] - dist[a][b0] - dist[b1][c0] - dist[c1][d]
+        if not math.isfinite(delta):
+            return False
+        window = [tour[(first + 1 + k) % n] for k in range(y)]
+        for k, city in enumerate(window[x:] + window[:x]):
+            i = (first + 1 + k) % n
+            tour[i] = city
+            pos[city] = i
+        self.delta += delta
+        self.push((a, b0, b1, c0, c1, d))
+        return True
+
+def closed_path(tour: list[int]) -> list[int]:
+    zero = tour.index(0)
+    return tour[zero:] + tour[:zero] + [0]
+
+def iterated_local_search(instance: tuple, start: int, seed: int, deadline: float, stop=None, cancel=None, progress=None):
+    # Local search from a nearest neighbour tour, then kick-and-repair rounds that keep the result only when it is
+    # shorter, until the deadline or HEURISTIC_PATIENCE * n kicks in a row without an improvement
+    dist, dist_lists, neighbours, closeness, symmetric = instance
+    n = len(dist_lists)
+    rng = random.Random(seed)
+    search = LocalSearch(dist_lists, neighbours, closeness, symmetric, nearest_neighbour_np(dist, start, deadline), deadline, stop, cancel)
+    search.push(search.tour)
+    search.optimize()
+    cost = tour_cost(dist_lists, search.tour)
+    best_tour, best_pos = search.tour[:], search.pos[:]
+    kicks = stalled = 0
+    while n >= 8 and math.isfinite(cost) and stalled < HEURISTIC_PATIENCE * n and not search.expired():
+        stalled += 1
+        search.delta = 0.0
+        if not search.segment_swap(rng):
+            continue
+        kicks += 1
+        search.optimize()
+        if search.delta < -1e-9:
+            cost += search.delta
+            best_tour[:], best_pos[:] = search.tour, search.pos
+            stalled = 0
+        else:
+            search.tour[:], search.pos[:] = best_tour, best_pos
+            search.queue.clear()
+            search.queued = [False] * n
+        if progress and kicks % PROGRESS_INTERVAL == 0:
+            progress({"kicks": kicks, "best_cost": cost, "best_path": closed_path(best_tour)})
+    # the running total drifts with rounding, the returned cost is summed again
+    return tour_cost(dist_lists, best_tour), best_tour, kicks, search.moves
+
+_worker_heuristic = None
+
+def init_heuristic_worker(instance: tuple, stop):
+    global _worker_heuristic, _worker_stop
+    _worker_heuristic = instance
+    _worker_stop = stop
+
+def heuristic_start(start: int, seed: int, deadline: float):
+    return iterated_local_search(_worker_heuristic, start, seed, deadline, _worker_stop)
+
+def solve_heuristic(matrix, time_limit_ms: Optional[int] = None, workers: Optional[int] = None, cancel=None, progress=None, **options):
+    # Not exact: the best tour found within the time limit (HEURISTIC_TIME_LIMIT_MS without one) by iterated local
+    # search, run from one start per worker when there is more than one
+    deadline = time.time() + (time_limit_ms or HEURISTIC_TIME_LIMIT_MS) / 1000
+    dist = np.array(matrix, dtype=float)
+    if dist.ndim != 2 or dist.shape[0] != dist.shape[1]:
+        raise ValueError("Матрица должна быть квадратной (N x N)")
+    n = len(dist)
+    np.fill_diagonal(dist, np.inf)
+    if n < 4:
+        # at most two different tours
+        cost, tour = min((sum(dist[t[k - 1], t[k]] for k in range(n)), list(t)) for t in itertools.permutations(range(n)) if t[0] == 0)
+        return {"distance": float(cost), "path": tour + [0], "status": "heuristic"} if math.isfinite(cost) else \
+            {"distance": "No solution", "path": None, "status": "heuristic"}
+
+    # The local search indexes lists (much faster than numpy scalars) and never looks at the diagonal, so a matrix
+    # that came in as lists is used as it is. Forbidden edges cost more than any tour without them instead of inf,
+    # which no move could compare against: the search then works its way off them like off any long edge.
+    search_dist = matrix if isinstance(matrix, list) else dist.tolist()
+    off_diagonal = ~np.eye(n, dtype=bool)
+    if not np.isfinite(dist[off_diagonal]).all():
+        penalty = n * (np.max(dist[np.isfinite(dist)], initial=0.0) + 1)
+        search_dist = np.where(np.isfinite(dist) | ~off_diagonal, dist, penalty).tolist()
+    instance = (dist, search_dist, *neighbour_lists(dist, HEURISTIC_NEIGHBOURS), is_symmetric(dist))
+    workers = min(workers or SOLVER_WORKERS, n)
+    starts = [0] + random.Random(n).sample(range(1, n), workers - 1)
+    if workers > 1:
+        stop = multiprocessing.Value("b", 0)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_heuristic_worker, initargs=(instance, stop)) as pool:
+            futures = [pool.submit(heuristic_start, start, seed, deadline - HEURISTIC_COLLECT_S) for seed, start in enumerate(starts)]
+            while wait(futures, timeout=0.1).not_done:
+                if cancel is not None and cancel.is_set():
+                    stop.value = 1
+                    raise SolveCancelled()
+                if time.time() >= deadline:
+                    stop.value = 1
+            runs = [future.result() for future in futures]
+    else:
+        runs = [iterated_local_search(instance, starts[0], 0, deadline, cancel=cancel, progress=progress)]
+    if cancel is not None and cancel.is_set():
+        raise SolveCancelled()
+
+    tour = min(runs, key=lambda run: run[0])[1]
+    cost = float(dist[tour, np.roll(tour, -1)].sum())
+    found = math.isfinite(cost)
     return {
-        "distance": best_cost if best_cost != math.inf else "No solution",
-        "path": best_path
+        "distance": cost if found else "No solution",
+        "path": closed_path(tour) if found else None,
+        "status": "heuristic",
+        "kicks": sum(run[2] for run in runs),
+        "moves": sum(run[3] for run in runs),
     }
 
+SOLVERS = {
+    "bnb": solve_tsp_internal,
+    "held_karp": solve_held_karp,
+    "heuristic": solve_heuristic,
+}
+
+def request_algorithm(tsp_request: TSPRequest) -> str:
+    if tsp_request.algorithm == "auto":
+        return select_algorithm(len(tsp_request.matrix), tsp_request.memory_budget_mb)
+    return tsp_request.algorithm
+
+def select_algorithm(n: int, memory_budget_mb: Optional[int] = None) -> str:
+    if n >= HEURISTIC_MIN_SIZE:
+        return "heuristic"
+    if n <= HELD_KARP_MAX_N and held_karp_memory(n) <= memory_budget_bytes(memory_budget_mb):
+        return "held_karp"
+    return "bnb"
+
 @app.post("/users/")
 def create_user(user: User):
     if is_login_taken(user.login):
@@ -235,34 +2083,34 @@ def create_user(user: User):
     user.id = int(time.time() * 1000)
     user.token = str(secrets.token_hex(32))
     
-    save_user(user)
+    try:
+        save_user(user)
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=400, detail="Логин уже занят")
     add_user_history(user.login, "Регистрация", f"Пользователь {user.login} зарегистрирован")
     
     return {"login": user.login, "token": user.token, "role": user.role}
 
 @app.post("/users/auth")
 def auth_user(params: AuthUser):
-    json_files_names = [file for file in os.listdir(USERS_DIR) if file.endswith('.json')]
-    for json_file_name in json_files_names:
-        file_path = os.path.join(USERS_DIR, json_file_name)
-        with open(file_path, 'r') as f:
-            user = User(**json.load(f))
-        
-        if user.login == params.login and user.password == params.password:
-            session_token = hashlib.sha256(f"{user.token}_{secrets.token_hex(32)}_{time.time()}".encode()).hexdigest()
-            session_tokens[session_token] = user.token 
-            
-            add_user_history(user.login, "Авторизация", "Успешный вход в систему")
-            
-            return AuthResponse(
-                login=user.login,
-                token=user.token,
-                session_token=session_token
-            )
+    user = get_user_store().get_by_login(params.login)
+    if user and user.password == params.password:
+        session_token = hashlib.sha256(f"{user.token}_{secrets.token_hex(32)}_{time.time()}".encode()).hexdigest()
+        get_session_store().create(session_token, user)
+
+        add_user_history(user.login, "Авторизация", "Успешный вход в систему")
+
+        return AuthResponse(
+            login=user.login,
+            token=user.token,
+            session_token=session_token
+        )
     raise HTTPException(status_code=401, detail="Invalid login or password")
 
 @app.get("/users/history")
 def get_user_history(
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_RETENTION),
+    before: Optional[int] = None,
     authorization: Optional[str] = Header(None),
     x_session_token: Optional[str] = Header(None),
     x_signature_time: Optional[str] = Header(None)
@@ -272,7 +2120,8 @@ def get_user_history(
     if not user:
         raise HTTPException(status_code=401, detail="Invalid session signature")
     
-    return {"login": user.login, "history": load_user_history(user.login)}
+    history, next_before = load_user_history(user.login, limit, before)
+    return {"login": user.login, "history": history, "next_before": next_before}
 
 @app.delete("/users/history")
 def delete_user_history(
@@ -285,9 +2134,8 @@ def delete_user_history(
     if not user:
         raise HTTPException(status_code=401, detail="Invalid session signature")
     
-    log_path = get_user_log_path(user.login)
-    if os.path.exists(log_path): os.remove(log_path)
-    
+    get_history_log().delete(user.login)
+
     add_user_history(user.login, "Удаление истории", "История действий пользователя очищена")
     
     return {"message": "User history deleted successfully"}
@@ -317,37 +2165,740 @@ def change_user_password(
     user.token = str(secrets.token_hex(32))
     save_user(user)
     
-    session_tokens_to_remove = [k for k, v in session_tokens.items() if v == old_token]
-    for token_to_remove in session_tokens_to_remove:
-        del session_tokens[token_to_remove]
+    get_session_store().revoke_token(old_token)
 
     add_user_history(user.login, "Изменение пароля и токена", "Пароль и технический токен обновлены. Требуется повторный вход.")
     
     return {"message": "Пароль и технический токен успешно обновлены. Требуется повторный вход (реавторизация)."}
 
+def validate_matrix(matrix):
+    if isinstance(matrix, np.ndarray):
+        if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1] or matrix.shape[0] < 2 or np.isnan(matrix).any() or (matrix < 0).any():
+            raise HTTPException(status_code=400, detail="Неверный формат матрицы или отрицательные расстояния")
+        return
+    n = len(matrix)
+    if n < 2 or any(len(row) != n for row in matrix) or any(val < 0 for row in matrix for val in row):
+        raise HTTPException(status_code=400, detail="Неверный формат матрицы или отрицательные расстояния")
+
+def distance_matrix(points: np.ndarray, metric: str) -> np.ndarray:
+    if metric == "haversine":
+        lat, lon = np.radians(points[:, 0]), np.radians(points[:, 1])
+        a = (np.sin((lat[:, None] - lat[None, :]) / 2) ** 2
+             + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin((lon[:, None] - lon[None, :]) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    # one coordinate at a time, so no n x n x d array is built
+    dist = np.zeros((len(points), len(points)))
+    for axis in points.T:
+        diff = axis[:, None] - axis[None, :]
+        dist += np.abs(diff) if metric == "manhattan" else diff * diff
+    if metric == "manhattan":
+        return dist
+    np.sqrt(dist, out=dist)
+    return np.floor(dist + 0.5) if metric == "euc_2d" else dist
+
+def edge_list_matrix(edges: list, num_cities: Optional[int], directed: bool) -> np.ndarray:
+    edge_array = np.array(edges, dtype=float).reshape(-1, 3)
+    sources, targets, weights = edge_array[:, 0].astype(int), edge_array[:, 1].astype(int), edge_array[:, 2]
+    n = num_cities if num_cities is not None else int(max(sources.max(initial=-1), targets.max(initial=-1))) + 1
+    if n > MAX_CITIES:
+        raise HTTPException(status_code=400, detail=f"Слишком много городов: не больше {MAX_CITIES}")
+    if (sources < 0).any() or (targets < 0).any() or (sources >= n).any() or (targets >= n).any() or (sources == targets).any():
+        raise HTTPException(status_code=400, detail="Неверный номер города в списке рёбер")
+    if np.isnan(weights).any() or (weights < 0).any():
+        raise HTTPException(status_code=400, detail="Неверный формат матрицы или отрицательные расстояния")
+    matrix = np.full((n, n), np.inf)
+    np.fill_diagonal(matrix, 0)
+    # of repeated edges the shortest is kept
+    np.minimum.at(matrix, (sources, targets), weights)
+    if not directed:
+        np.minimum.at(matrix, (targets, sources), weights)
+    return matrix
+
+def resolve_matrix(tsp_request: TSPRequest):
+    # fills in tsp_request.matrix from points or edges, after the signature over the request as sent has been checked
+    given = [field for field in ("matrix", "points", "edges") if getattr(tsp_request, field) is not None]
+    if len(given) != 1:
+        raise HTTPException(status_code=400, detail="Нужно передать ровно одно из полей: matrix, points или edges")
+    if tsp_request.points is not None:
+        try:
+            points = np.array(tsp_request.points, dtype=float)
+        except ValueError:
+            points = None
+        if (points is None or points.ndim != 2 or points.shape[1] < 2 or not np.isfinite(points).all()
+                or (tsp_request.metric in ("haversine", "euc_2d") and points.shape[1] != 2)):
+            raise HTTPException(status_code=400, detail="Неверный формат координат")
+        if len(points) > MAX_CITIES:
+            raise HTTPException(status_code=400, detail=f"Слишком много городов: не больше {MAX_CITIES}")
+        tsp_request.matrix = distance_matrix(points, tsp_request.metric)
+    elif tsp_request.edges is not None:
+        tsp_request.matrix = edge_list_matrix(tsp_request.edges, tsp_request.num_cities, tsp_request.directed)
+    validate_matrix(tsp_request.matrix)
+
+def matrix_digest(matrix) -> str:
+    dist = np.array(matrix, dtype=np.float64) + 0.0
+    np.fill_diagonal(dist, np.inf)
+    return hashlib.sha256(len(matrix).to_bytes(4, "little") + dist.tobytes()).hexdigest()
+
+def solution_cache_keys(tsp_request: TSPRequest) -> tuple[str, Optional[str]]:
+    # Proven results (optimal / infeasible) are shared by every request for the matrix; a result cut short by a limit
+    # is only reused for a request with exactly the same limits, backend and warm start, never under the plain digest.
+    digest = matrix_digest(tsp_request.matrix)
+    if not (tsp_request.time_limit_ms or tsp_request.max_nodes or tsp_request.target_gap):
+        return digest, None
+    if tsp_request.resume:
+        # each resumed run continues further than the last, so its partial result is never a cached one
+        return digest, None
+    return digest, (f"{digest}-limit-{request_algorithm(tsp_request)}-{tsp_request.warm_start}-{tsp_request.time_limit_ms}-"
+                    f"{tsp_request.max_nodes}-{tsp_request.target_gap}-{tsp_request.bound}")
+
+def get_cached_solution(tsp_request: TSPRequest) -> Optional[dict]:
+    started = time.perf_counter()
+    digest, limit_key = solution_cache_keys(tsp_request)
+    cached = solution_cache.get(digest) or (solution_cache.get(limit_key) if limit_key else None)
+    if cached:
+        cached["cached"] = True
+        # the stored time is the original solve's, this request only took the lookup
+        cached["solve_time"] = time.perf_counter() - started
+    return cached
+
+def cache_solution(tsp_request: TSPRequest, result: dict):
+    digest, limit_key = solution_cache_keys(tsp_request)
+    if result.get("status") in ("optimal", "infeasible"):
+        solution_cache.put(digest, result)
+    elif result.get("status") in ("limit_reached", "heuristic") and limit_key:
+        solution_cache.put(limit_key, result)
+
+def observe_solve(result: dict):
+    metrics.observe("tsp_solve_seconds", result["solve_time"], algorithm=result["algorithm"], status=result.get("status"))
+    if "nodes_explored" in result:
+        metrics.inc("tsp_solver_nodes_explored_total", result["nodes_explored"])
+        metrics.inc("tsp_solver_nodes_popped_total", result["nodes_popped"])
+        metrics.inc("tsp_solver_nodes_pruned_total", result["nodes_pruned"])
+        metrics.inc("tsp_solver_nodes_dominated_total", result["nodes_dominated"])
+        metrics.observe("tsp_solver_max_frontier_size", result["max_frontier_size"])
+        metrics.inc("tsp_solver_reduction_seconds_total", result["reduction_time"])
+        metrics.inc("tsp_solver_one_tree_seconds_total", result["one_tree_time"])
+        metrics.inc("tsp_solver_checkpoints_skipped_total", result["checkpoints_skipped"])
+
+def solve_request(tsp_request: TSPRequest, cancel=None, progress=None, workers: Optional[int] = None) -> dict:
+    algorithm = request_algorithm(tsp_request)
+    started = time.perf_counter()
+    result = SOLVERS[algorithm](tsp_request.matrix, memory_budget_mb=tsp_request.memory_budget_mb, warm_start=tsp_request.warm_start,
+                                time_limit_ms=tsp_request.time_limit_ms, max_nodes=tsp_request.max_nodes, target_gap=tsp_request.target_gap,
+                                bound=tsp_request.bound, workers=workers, cancel=cancel, progress=progress,
+                                checkpoint_interval_s=tsp_request.checkpoint_interval_s, resume=tsp_request.resume)
+    result["algorithm"] = algorithm
+    result["solve_time"] = time.perf_counter() - started
+    return result
+
+class SolverBusy(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("solver lane is full")
+        self.retry_after = retry_after
+
+def solver_busy_error(e: SolverBusy) -> HTTPException:
+    return HTTPException(status_code=429, detail="Решатель перегружен, повторите позже", headers={"Retry-After": str(e.retry_after)})
+
+_service_cancel_flags = None
+_service_progress = None
+
+def init_service_worker(cancel_flags, progress_queue):
+    global _service_cancel_flags, _service_progress
+    _service_cancel_flags = cancel_flags
+    _service_progress = progress_queue
+
+class SlotCancel:
+    # threading.Event look-alike for a pool process: the request's slot in the shared cancel flags
+    __slots__ = ("slot",)
+
+    def __init__(self, slot: int):
+        self.slot = slot
+
+    def is_set(self) -> bool:
+        return bool(_service_cancel_flags[self.slot])
+
+def solve_in_worker(slot: int, task_id: int, matrix, options: dict, workers: int, report_progress: bool, profile: bool = False) -> dict:
+    if isinstance(matrix, tuple):
+        name, shape = matrix
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            matrix = np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+    progress = (lambda snapshot: _service_progress.put((slot, task_id, snapshot))) if report_progress else None
+    tsp_request = TSPRequest.model_construct(matrix=matrix, **options)
+    if not profile:
+        return solve_request(tsp_request, SlotCancel(slot), progress, workers)
+    profiler = cProfile.Profile()
+    result = profiler.runcall(solve_request, tsp_request, SlotCancel(slot), progress, workers)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    result["profile"] = summary.getvalue()
+    return result
+
+class SolveLane:
+    # A process pool for one range of matrix sizes, so small requests never queue behind big ones.
+    # At most max_in_flight requests are admitted (running or queued in the pool).
+    def __init__(self, name: str, max_n: float, workers: int, solver_workers: Optional[int]):
+        self.name = name
+        self.max_n = max_n
+        self.workers = workers
+        self.solver_workers = solver_workers
+        self.max_in_flight = workers * (1 + SOLVE_QUEUE_PER_WORKER)
+        self.in_flight = 0
+        self.average_time = 1.0
+        self.pool = None
+
+class SolveTicket:
+    __slots__ = ("lane", "pool", "slot", "task_id", "future", "shm", "started", "released")
+
+    def __init__(self, lane: SolveLane, slot: int, task_id: int):
+        self.lane = lane
+        self.pool = lane.pool
+        self.slot = slot
+        self.task_id = task_id
+        self.future = None
+        self.shm = None
+        self.started = time.time()
+        self.released = False
+
+class SolverService:
+    # Solves run in pre-forked processes so they never hold the server's GIL. Matrices travel as float64 arrays
+    # (through shared memory from SHARED_MEMORY_MIN_SIZE cities up), cancellation through a shared flag per admitted
+    # request, and progress snapshots through one queue that a thread here hands to the waiting callbacks.
+    def __init__(self, lanes: list[SolveLane]):
+        self.lanes = lanes
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        self.task_ids = itertools.count()
+        self.free_slots = list(range(sum(lane.max_in_flight for lane in lanes)))
+        self.callbacks = {}
+        self.cancel_flags = None
+        self.progress_queue = None
+
+    def start(self):
+        with self.lock:
+            if self.cancel_flags is not None:
+                return
+            # workers attaching to a shared matrix register it with the resource tracker; forked after the tracker is
+            # up they share ours, otherwise each starts its own and "cleans up" the segment when it exits
+            resource_tracker.ensure_running()
+            self.cancel_flags = multiprocessing.Array("b", len(self.free_slots), lock=False)
+            self.progress_queue = multiprocessing.Queue()
+            for lane in self.lanes:
+                self.start_pool(lane, prefork=True)
+        threading.Thread(target=self.dispatch_progress, name="solver-progress", daemon=True).start()
+
+    def start_pool(self, lane: SolveLane, prefork: bool = False):
+        lane.pool = ProcessPoolExecutor(max_workers=lane.workers, initializer=init_service_worker,
+                                        initargs=(self.cancel_flags, self.progress_queue))
+        if prefork:
+            wait([lane.pool.submit(time.sleep, 0) for _ in range(lane.workers)])
+
+    def shutdown(self):
+        with self.lock:
+            if self.cancel_flags is None:
+                return
+            for slot in range(len(self.cancel_flags)):
+                self.cancel_flags[slot] = 1
+            pools = [lane.pool for lane in self.lanes]
+            progress_queue = self.progress_queue
+            self.cancel_flags = None
+        # outside the lock: the pools run release() for their cancelled and finishing futures, which takes it
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+        progress_queue.put(None)
+
+    def dispatch_progress(self):
+        while True:
+            message = self.progress_queue.get()
+            if message is None:
+                return
+            slot, task_id, snapshot = message
+            callback = self.callbacks.get(slot)
+            if callback and callback[0] == task_id:
+                callback[1](snapshot)
+
+    def lane_for(self, n: int) -> SolveLane:
+        return next(lane for lane in self.lanes if n <= lane.max_n)
+
+    def busy(self, n: int) -> bool:
+        lane = self.lane_for(n)
+        return lane.in_flight >= lane.max_in_flight
+
+    def admit(self, n: int, block: bool = False) -> SolveTicket:
+        self.start()
+        lane = self.lane_for(n)
+        with self.lock:
+            while lane.in_flight >= lane.max_in_flight:
+                if not block:
+                    metrics.inc("tsp_solver_rejected_total", lane=lane.name)
+                    raise SolverBusy(max(math.ceil(lane.average_time), 1))
+                self.slot_freed.wait()
+            lane.in_flight += 1
+            return SolveTicket(lane, self.free_slots.pop(), next(self.task_ids))
+
+    def submit(self, ticket: SolveTicket, tsp_request: TSPRequest, progress=None, profile: bool = False):
+        n = len(tsp_request.matrix)
+        if n >= SHARED_MEMORY_MIN_SIZE:
+            # written straight into the segment, converted to float64 on the way
+            ticket.shm = shared_memory.SharedMemory(create=True, size=n * n * 8)
+            np.ndarray((n, n), dtype=np.float64, buffer=ticket.shm.buf)[:] = tsp_request.matrix
+            matrix = (ticket.shm.name, (n, n))
+        else:
+            matrix = np.ascontiguousarray(tsp_request.matrix, dtype=np.float64)
+        if progress:
+            self.callbacks[ticket.slot] = (ticket.task_id, progress)
+        try:
+            # a profiled solve runs with one solver worker, the only one cProfile can see
+            ticket.future = ticket.pool.submit(solve_in_worker, ticket.slot, ticket.task_id, matrix,
+                                               tsp_request.model_dump(exclude={"matrix", "points", "edges"}),
+                                               1 if profile else ticket.lane.solver_workers, progress is not None, profile)
+        except Exception:
+            self.release(ticket)
+            raise
+        ticket.future.add_done_callback(lambda future: self.release(ticket))
+        return ticket.future
+
+    def release(self, ticket: SolveTicket):
+        future = ticket.future
+        error = future.exception() if future is not None and not future.cancelled() else None
+        if future is not None and not future.cancelled() and error is None:
+            observe_solve(future.result())
+        if ticket.shm is not None:
+            ticket.shm.close()
+            ticket.shm.unlink()
+        lane = ticket.lane
+        with self.lock:
+            ticket.released = True
+            self.callbacks.pop(ticket.slot, None)
+            if self.cancel_flags is not None:
+                self.cancel_flags[ticket.slot] = 0
+            self.free_slots.append(ticket.slot)
+            lane.in_flight -= 1
+            lane.average_time = 0.8 * lane.average_time + 0.2 * (time.time() - ticket.started)
+            if isinstance(error, BrokenProcessPool) and lane.pool is ticket.pool and self.cancel_flags is not None:
+                # a worker died (e.g. killed for memory) and took the pool with it; later requests get a fresh one
+                self.start_pool(lane)
+            self.slot_freed.notify_all()
+
+    def cancel(self, ticket: SolveTicket):
+        if ticket.future.cancel():
+            return
+        with self.lock:
+            # once released the slot may already belong to another request
+            if not ticket.released and self.cancel_flags is not None:
+                self.cancel_flags[ticket.slot] = 1
+
+    def result(self, ticket: SolveTicket, cancel=None) -> dict:
+        while True:
+            try:
+                return ticket.future.result(timeout=SOLVE_CANCEL_POLL)
+            except FutureTimeoutError:
+                if cancel is not None and cancel.is_set():
+                    self.cancel(ticket)
+            except CancelledError:
+                raise SolveCancelled()
+
+    def solve(self, tsp_request: TSPRequest, cancel=None, progress=None, block: bool = False, profile: bool = False) -> dict:
+        ticket = self.admit(len(tsp_request.matrix), block)
+        self.submit(ticket, tsp_request, progress, profile)
+        return self.result(ticket, cancel)
+
+solver_service = SolverService([
+    SolveLane("small", SOLVE_SMALL_MAX_N, SOLVE_SMALL_WORKERS, 1),
+    SolveLane("large", math.inf, SOLVE_LARGE_WORKERS, None),
+])
+
+def run_solve(tsp_request: TSPRequest, cancel=None, progress=None, block: bool = False) -> dict:
+    # block=False raises SolverBusy when the request's lane is full, block=True waits for room
+    cached = get_cached_solution(tsp_request)
+    if cached:
+        return cached
+    result = solver_service.solve(tsp_request, cancel, progress, block)
+    cache_solution(tsp_request, result)
+    return result
+
 @app.post("/solve", response_model=TSPResponse)
 def solve_tsp(
     tsp_request: TSPRequest,
     authorization: Optional[str] = Header(None),
     x_session_token: Optional[str] = Header(None),
-    x_signature_time: Optional[str] = Header(None)
+    x_signature_time: Optional[str] = Header(None),
+    x_profile: Optional[str] = Header(None)
 ):
-    request_body = json.dumps(tsp_request.model_dump(), sort_keys=True)
+    request_body = json.dumps(tsp_request.model_dump(exclude_unset=True), sort_keys=True)
     user = verify_signature(authorization, x_session_token, x_signature_time, request_body)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid session signature")
     
     try:
-        matrix = tsp_request.matrix
-        n = len(matrix)
-        if n < 2 or any(len(row) != n for row in matrix) or any(val < 0 for row in matrix for val in row):
-            raise HTTPException(status_code=400, detail="Неверный формат матрицы или отрицательные расстояния")
-        
-        result = solve_tsp_internal(tsp_request.matrix)
+        resolve_matrix(tsp_request)
+        n = len(tsp_request.matrix)
+
+        if x_profile:
+            # X-Profile: 1 bypasses the cache and runs the solve under cProfile in its pool worker (admitted like any
+            # other solve), returning the top functions by cumulative time in `profile`
+            result = solver_service.solve(tsp_request, profile=True)
+            cache_solution(tsp_request, {key: value for key, value in result.items() if key != "profile"})
+        else:
+            result = run_solve(tsp_request)
         add_user_history(user.login, "Решение TSP", f"Матрица {n}x{n}, результат: {result['distance']}")
         
-        return TSPResponse(distance=result["distance"], path=result["path"])
+        return TSPResponse(**result)
     except HTTPException:
         raise
+    except SolverBusy as e:
+        raise solver_busy_error(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error solving TSP: {str(e)}")
+
+def run_solve_job(job: SolveJob):
+    if job.cancel.is_set():
+        return
+    job.status = "running"
+
+    def update_progress(progress: dict):
+        job.progress = progress
+
+    try:
+        result = run_solve(job.request, job.cancel, update_progress, block=True)
+        n = len(job.request.matrix)
+        add_user_history(job.login, "Решение TSP", f"Матрица {n}x{n}, результат: {result['distance']}")
+        job.result = TSPResponse(**result)
+        job.status = "done"
+    except SolveCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        job.error = f"Error solving TSP: {str(e)}"
+        job.status = "failed"
+    finally:
+        job.finished_at = time.time()
+
+def purge_finished_jobs():
+    now = time.time()
+    for job_id in [job_id for job_id, job in solve_jobs.items() if job.finished_at and now - job.finished_at > JOB_TTL]:
+        del solve_jobs[job_id]
+
+def get_user_job(job_id: str, user: User) -> SolveJob:
+    job = solve_jobs.get(job_id)
+    if not job or job.login != user.login:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+@app.post("/solve/jobs", response_model=SolveJobResponse)
+def submit_solve_job(
+    tsp_request: TSPRequest,
+    authorization: Optional[str] = Header(None),
+    x_session_token: Optional[str] = Header(None),
+    x_signature_time: Optional[str] = Header(None)
+):
+    request_body = json.dumps(tsp_request.model_dump(exclude_unset=True), sort_keys=True)
+    user = verify_signature(authorization, x_session_token, x_signature_time, request_body)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid session signature")
+
+    resolve_matrix(tsp_request)
+
+    with solve_jobs_lock:
+        purge_finished_jobs()
+        active = [job for job in solve_jobs.values() if job.status in ("queued", "running")]
+        if len(active) >= JOB_QUEUE_LIMIT:
+            raise HTTPException(status_code=503, detail="Очередь задач переполнена, повторите позже")
+        if sum(job.login == user.login for job in active) >= JOB_USER_LIMIT:
+            raise HTTPException(status_code=429, detail="Превышено число одновременных задач пользователя")
+        job = SolveJob(user.login, tsp_request)
+        solve_jobs[job.id] = job
+
+    job_executor.submit(run_solve_job, job)
+    return job.response()
+
+@app.get("/solve/jobs/{job_id}", response_model=SolveJobResponse)
+def get_solve_job(
+    job_id: str,
+    authorization: Optional[str] = Header(None),
+    x_session_token: Optional[str] = Header(None),
+    x_signature_time: Optional[str] = Header(None)
+):
+    user = verify_signature(authorization, x_session_token, x_signature_time, "")
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid session signature")
+
+    return get_user_job(job_id, user).response()
+
+@app.delete("/solve/jobs/{job_id}", response_model=SolveJobResponse)
+def cancel_solve_job(
+    job_id: str,
+    authorization: Optional[str] = Header(None),
+    x_session_token: Optional[str] = Header(None),
+    x_signature_time: Optional[str] = Header(None)
+):
+    user = verify_signature(authorization, x_session_token, x_signature_time, "")
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid session signature")
+
+    job = get_user_job(job_id, user)
+    if job.status in ("queued", "running"):
+        job.cancel.set()
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = time.time()
+    return job.response()
+
+@app.post("/solve/batch")
+def solve_tsp_batch(
+    batch_request: TSPBatchRequest,
+    authorization: Optional[str] = Header(None),
+    x_session_token: Optional[str] = Header(None),
+    x_signature_time: Optional[str] = Header(None)
+):
+    request_body = json.dumps(batch_request.model_dump(exclude_unset=True), sort_keys=True)
+    user = verify_signature(authorization, x_session_token, x_signature_time, request_body)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid session signature")
+    if len(batch_request.matrices) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"В пакете не может быть больше {BATCH_MAX_ITEMS} матриц")
+
+    options = batch_request.model_dump(exclude={"matrices"}, exclude_unset=True)
+
+    def item_line(index: int, result: Optional[dict] = None, error: Optional[str] = None) -> str:
+        if result is not None:
+            return json.dumps({"index": index, "result": TSPResponse(**result).model_dump()}, ensure_ascii=False) + "\n"
+        return json.dumps({"index": index, "error": error}, ensure_ascii=False) + "\n"
+
+    def finished(future) -> str:
+        index, tsp_request, ticket = futures.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            counts["failed"] += 1
+            return item_line(index, error=f"Error solving TSP: {str(e)}")
+        cache_solution(tsp_request, result)
+        counts["solved"] += 1
+        return item_line(index, result)
+
+    counts = {"solved": 0, "failed": 0}
+    futures = {}
+
+    def stream():
+        # Lines are emitted in completion order, each tagged with the position of its matrix in the request.
+        # Items go through the solver lanes like single solves; when a lane is full the batch waits on its own
+        # items first and only blocks for room when it has none running.
+        try:
+            for index, matrix in enumerate(batch_request.matrices):
+                try:
+                    validate_matrix(matrix)
+                    tsp_request = TSPRequest(matrix=matrix, **options)
+                except HTTPException as e:
+                    counts["failed"] += 1
+                    yield item_line(index, error=e.detail)
+                    continue
+                cached = get_cached_solution(tsp_request)
+                if cached:
+                    counts["solved"] += 1
+                    yield item_line(index, cached)
+                    continue
+                while futures and solver_service.busy(len(matrix)):
+                    done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield finished(future)
+                ticket = solver_service.admit(len(matrix), block=True)
+                futures[solver_service.submit(ticket, tsp_request)] = (index, tsp_request, ticket)
+
+            for future in as_completed(list(futures)):
+                yield finished(future)
+        finally:
+            for future, (_, _, ticket) in list(futures.items()):
+                solver_service.cancel(ticket)
+            add_user_history(user.login, "Пакетное решение TSP",
+                             f"Матриц: {len(batch_request.matrices)}, решено: {counts['solved']}, ошибок: {counts['failed']}")
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def verify_solve_request(tsp_request: TSPRequest, authorization: Optional[str], x_session_token: Optional[str],
+                         x_signature_time: Optional[str]) -> User:
+    request_body = json.dumps(tsp_request.model_dump(exclude_unset=True), sort_keys=True)
+    user = verify_signature(authorization, x_session_token, x_signature_time, request_body)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid session signature")
+    resolve_matrix(tsp_request)
+    return user
+
+@app.post("/solve/stream")
+async def solve_tsp_stream(
+    tsp_request: TSPRequest,
+    request: Request,
+    interval_ms: int = Query(STREAM_PROGRESS_INTERVAL_MS, ge=50),
+    authorization: Optional[str] = Header(None),
+    x_session_token: Optional[str] = Header(None),
+    x_signature_time: Optional[str] = Header(None)
+):
+    # serialising the request for its signature and building the matrix are both O(n^2), so not on the event loop
+    user = await run_in_threadpool(verify_solve_request, tsp_request, authorization, x_session_token, x_signature_time)
+    if solver_service.busy(len(tsp_request.matrix)):
+        raise solver_busy_error(SolverBusy(max(math.ceil(solver_service.lane_for(len(tsp_request.matrix)).average_time), 1)))
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancel = threading.Event()
+
+    def publish(event: str, data=None):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    def work():
+        try:
+            result = run_solve(tsp_request, cancel, lambda snapshot: publish("progress", snapshot), block=True)
+            n = len(tsp_request.matrix)
+            add_user_history(user.login, "Решение TSP", f"Матрица {n}x{n}, результат: {result['distance']}")
+            publish("result", TSPResponse(**result).model_dump())
+        except SolveCancelled:
+            publish("cancelled")
+        except Exception as e:
+            publish("error", {"detail": f"Error solving TSP: {str(e)}"})
+
+    async def stream():
+        # Every incumbent improvement is sent as soon as it is known; the rest of the progress is sent at most once per
+        # interval_ms. When the client goes away the generator is closed and the solve is cancelled.
+        started = last_sent = time.monotonic()
+        last_cost = None
+        last_nodes = 0
+        solver = loop.run_in_executor(None, work)
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(events.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    continue
+
+                if event != "progress":
+                    yield sse_event(event, data)
+                    return
+
+                if data.get("best_path") and data.get("best_cost") != last_cost:
+                    last_cost = data["best_cost"]
+                    yield sse_event("incumbent", {"cost": data["best_cost"], "path": data["best_path"], "elapsed": time.monotonic() - started})
+
+                now = time.monotonic()
+                if now - last_sent >= interval_ms / 1000:
+                    progress = {key: value for key, value in data.items() if key != "best_path"}
+                    if "nodes_popped" in data:
+                        progress["nodes_per_sec"] = (data["nodes_popped"] - last_nodes) / (now - last_sent)
+                        last_nodes = data["nodes_popped"]
+                    progress["elapsed"] = now - started
+                    last_sent = now
+                    yield sse_event("progress", progress)
+        finally:
+            cancel.set()
+            await asyncio.shield(solver)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def decompress_body(raw: bytes, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(raw, max_size + 1)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Некорректное gzip-тело запроса")
+    if len(data) > max_size or decompressor.unconsumed_tail:
+        raise HTTPException(status_code=413, detail="Матрица слишком большая")
+    return data
+
+def parse_binary_matrix(data: bytes, content_type: str, matrix_size: Optional[int], matrix_dtype: str) -> np.ndarray:
+    # Both formats end up as np.frombuffer over the request bytes, so parsing copies nothing. The matrix is copied
+    # later all the same: into the solver worker (through shared memory from SHARED_MEMORY_MIN_SIZE cities, converted
+    # to float64), out of the segment there, and into each solver's own working form (lists for branch and bound).
+    try:
+        if content_type == "application/x-npy":
+            stream = io.BytesIO(data)
+            version = np.lib.format.read_magic(stream)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(stream)
+            if dtype.kind != "f" or len(shape) != 2:
+                raise ValueError()
+            matrix = np.frombuffer(data, dtype=dtype, count=shape[0] * shape[1], offset=stream.tell())
+            return matrix.reshape(shape, order="F" if fortran_order else "C")
+
+        dtype = {"float32": "<f4", "float64": "<f8"}[matrix_dtype]
+        if not matrix_size or len(data) != matrix_size * matrix_size * np.dtype(dtype).itemsize:
+            raise ValueError()
+        return np.frombuffer(data, dtype=dtype).reshape(matrix_size, matrix_size)
+    except (ValueError, KeyError):
+        raise HTTPException(status_code=400, detail="Неверный формат бинарной матрицы")
+
+def read_binary_request(raw: bytes, content_type: Optional[str], content_encoding: Optional[str], matrix_size: Optional[int],
+                        matrix_dtype: str, solve_options: str, authorization: Optional[str], x_session_token: Optional[str],
+                        x_signature_time: Optional[str]) -> tuple[User, TSPSolveOptions, np.ndarray]:
+    user = verify_signature(authorization, x_session_token, x_signature_time, solve_options.encode() + raw)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid session signature")
+
+    try:
+        options = TSPSolveOptions(**json.loads(solve_options)) if solve_options else TSPSolveOptions()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Неверные параметры решения: {str(e)}")
+
+    data = decompress_body(raw, BINARY_MAX_BYTES) if content_encoding == "gzip" else raw
+    matrix = parse_binary_matrix(data, (content_type or "").split(";")[0].strip(), matrix_size, matrix_dtype)
+    validate_matrix(matrix)
+    return user, options, matrix
+
+@app.post("/solve/binary", response_model=TSPResponse)
+async def solve_tsp_binary(
+    request: Request,
+    content_type: Optional[str] = Header("application/octet-stream"),
+    content_encoding: Optional[str] = Header(None),
+    x_matrix_size: Optional[int] = Header(None),
+    x_matrix_dtype: str = Header("float64"),
+    x_solve_options: str = Header(""),
+    authorization: Optional[str] = Header(None),
+    x_session_token: Optional[str] = Header(None),
+    x_signature_time: Optional[str] = Header(None)
+):
+    # The body is the matrix itself: either raw little-endian float32/float64 values (n from X-Matrix-Size, type from
+    # X-Matrix-Dtype) or a .npy file (Content-Type: application/x-npy), optionally gzip-compressed. Solver options
+    # come as JSON in X-Solve-Options. The signature covers the options followed by the body exactly as sent, so it
+    # is checked before anything is decompressed or parsed. Only reading the body happens on the event loop, capped at
+    # BINARY_MAX_BYTES (by Content-Length when it is given, otherwise as it arrives); the rest runs in the thread pool.
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > BINARY_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Матрица слишком большая")
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > BINARY_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Матрица слишком большая")
+        chunks.append(chunk)
+    user, options, matrix = await run_in_threadpool(read_binary_request, b"".join(chunks), content_type, content_encoding, x_matrix_size,
+                                                    x_matrix_dtype, x_solve_options, authorization, x_session_token, x_signature_time)
+
+    try:
+        tsp_request = TSPRequest.model_construct(matrix=matrix, **options.model_dump())
+        result = await run_in_threadpool(run_solve, tsp_request)
+        n = len(matrix)
+        add_user_history(user.login, "Решение TSP", f"Матрица {n}x{n}, результат: {result['distance']}")
+        return TSPResponse(**result)
+    except SolverBusy as e:
+        raise solver_busy_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error solving TSP: {str(e)}")
+
+@app.get("/metrics")
+def get_metrics():
+    metrics.set("tsp_solution_cache_requests_total", solution_cache.hits - solution_cache.disk_hits, result="hit")
+    metrics.set("tsp_solution_cache_requests_total", solution_cache.disk_hits, result="disk_hit")
+    metrics.set("tsp_solution_cache_requests_total", solution_cache.misses, result="miss")
+    metrics.set("tsp_solution_cache_entries", len(solution_cache.entries))
+    with solve_jobs_lock:
+        statuses = [job.status for job in solve_jobs.values()]
+    for status in ("queued", "running", "done", "failed", "cancelled"):
+        metrics.set("tsp_solve_jobs", statuses.count(status), status=status)
+    metrics.set("tsp_history_pending_entries", get_history_log().pending_count)
+    metrics.set("tsp_sessions", len(get_session_store().sessions))
+    for lane in solver_service.lanes:
+        metrics.set("tsp_solver_in_flight", lane.in_flight, lane=lane.name)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")